@@ -0,0 +1,673 @@
+import argparse
+import contextlib
+import csv
+import io
+import random
+import re
+import shutil
+import sys
+import tempfile
+import time
+import traceback
+from pathlib import Path
+
+import pandas as pd
+from openpyxl import Workbook, load_workbook
+
+with contextlib.redirect_stdout(io.StringIO()): # Silence the allocator's import banner
+    import scrap_allocator
+from layout_cache import load_cached_layout, save_cached_layout
+from recap_journal import list_runs
+from worksheet_readers import WorksheetReader, is_engine_available
+
+# Differential check of the allocator against a frozen copy of the original algorithm.
+#
+# Randomized worksheet/recap inputs are run through the legacy reference below and
+# through every current code path; column C of 'By Consumer' must match cell for cell.
+#   In-memory cases: many generated inputs through the allocator functions directly.
+#   File cases: every Nth input is also written to disk and run through main() end to
+#   end, once per installed reader engine, with a cold and then a warm layout cache,
+#   and the last run is rolled back from the journal to check the template comes back.
+#   Consolidation: the depot sheets are also split over several worksheet files (and
+#   stale values replaced through an override file) and merged back.
+#   Reader cases: every Nth input is written as .xlsx and as CSV exports, and the partial
+#   aggregate of each installed reader engine must equal the openpyxl one exactly.
+#   .xlsb is not covered: no writer for it is available to generate fixtures.
+#
+# Usage: python equivalence_harness.py [--cases 2000] [--seed 0] [--time-budget 300]
+# Running out of time before all cases ran counts as a failure.
+
+# --- Configuration ---
+DEFAULT_CASES = 2000
+DEFAULT_FILE_CASE_EVERY = 50
+DEFAULT_READER_CASE_EVERY = 10
+REFERENCE_READER_ENGINE = 'openpyxl' # What the original script read worksheets with
+DEFAULT_TIME_BUDGET = 300 # Seconds
+WORKSHEET_HEADER_ROW = 3
+RECAP_HEADER_ROW = 6
+
+UNMAPPED_GRADES = ['Shredded', 'Zorba', 'Unknown grade', 'ALUM CANS', 'P&S', 'HMS']
+UNMAPPED_MILLS = ['CMC - LCMC606', 'East Jordan - LEJO601', 'Nucor - LNUC100']
+RECAP_DEPOT_HEADERS = ['D401/D404/D410', 'D401', 'D404', 'D410', 'D402', 'D405', 'D407',
+                       'D404/D410', 'Houston - D402', 'D402/D405', 'D4011', 'Depot D401']
+ALIAS_SUFFIXES = ['', '', '', ' - 5ft', '-Prem', ' 2', 'X', 's']
+
+
+# --- Frozen Legacy Reference ---
+# A copy of the allocation logic as it stood before any optimization. Do not change it
+# to follow new behavior; it is the reference the current code is checked against.
+def legacy_normalize_grade(grade):
+    if not grade:
+        return None
+    grade = ' '.join(grade.lower().split())
+    grade = re.sub(r'[^\w\s-]', '', grade)
+    return grade
+
+def legacy_find_matching_grade(worksheet_grade, depot_mapping):
+    if not worksheet_grade:
+        return None
+    normalized_grade = legacy_normalize_grade(worksheet_grade)
+    if not normalized_grade:
+        return None
+    if worksheet_grade in depot_mapping:
+        return worksheet_grade
+    for mapping_grade in depot_mapping.keys():
+        if legacy_normalize_grade(mapping_grade) == normalized_grade:
+            return mapping_grade
+    for mapping_grade in depot_mapping.keys():
+        if normalized_grade in legacy_normalize_grade(mapping_grade) or legacy_normalize_grade(mapping_grade) in normalized_grade:
+            return mapping_grade
+    return None
+
+def legacy_find_depot_numbers_in_recap_row(text):
+    if not isinstance(text, str):
+        return []
+    return re.findall(r'D(\d+)(?!\d)', text)
+
+def legacy_aggregate(sheet_frames, mapping):
+    """Legacy worksheet pass. `sheet_frames` maps sheet name to its frame read with headers on row 3."""
+    aggregated_amounts = {}
+    depot_grand_totals = {}
+    sheets_to_process = [s for s in scrap_allocator.WORKSHEET_DEPOT_SHEETS if s in sheet_frames]
+    for sheet_name in sheets_to_process:
+        match = re.search(r'\d+', sheet_name)
+        depot_num = match.group(0) if match else None
+        if not depot_num:
+            continue
+        df_sheet = sheet_frames[sheet_name]
+        if scrap_allocator.WORKSHEET_GRADE_COL not in df_sheet.columns:
+            continue
+        if scrap_allocator.WORKSHEET_TONS_COL not in df_sheet.columns:
+            continue
+        for index, row in df_sheet.iterrows():
+            grade_value = row[scrap_allocator.WORKSHEET_GRADE_COL]
+            worksheet_grade_original = str(grade_value).strip() if pd.notna(grade_value) else None
+            tons = pd.to_numeric(row[scrap_allocator.WORKSHEET_TONS_COL], errors='coerce')
+            if not worksheet_grade_original or worksheet_grade_original.isspace() or pd.isna(tons) or tons == 0:
+                continue
+            depot_mapping = mapping.get(depot_num)
+            if not depot_mapping:
+                continue
+            matching_grade = legacy_find_matching_grade(worksheet_grade_original, depot_mapping)
+            if not matching_grade:
+                continue
+            grade_info = depot_mapping[matching_grade]
+            key = (depot_num, grade_info['mill'], grade_info['alias'])
+            aggregated_amounts[key] = aggregated_amounts.get(key, 0) + tons
+            depot_grand_totals[depot_num] = depot_grand_totals.get(depot_num, 0) + tons
+    return aggregated_amounts, depot_grand_totals
+
+def legacy_recap_values(df_recap, formula_rows, aggregated_amounts, depot_grand_totals, mapping):
+    """Legacy recap passes. Returns {excel_row: value} for every non-formula column C cell it writes."""
+    structure_col = scrap_allocator.RECAP_STRUCTURE_COL
+    amount_col = scrap_allocator.RECAP_AMOUNT_COL
+    df_recap_modified = df_recap.copy()
+    df_recap_modified[amount_col] = 0.0
+
+    current_mill = None
+    current_depot_header_text = None
+    current_depot_sum = 0
+    current_mill_sum = 0
+    rows_to_update_with_totals = {}
+    rows_to_update_with_grand_totals = {}
+
+    for index, row in df_recap.iterrows():
+        structure_text = str(row[structure_col]).strip() if pd.notna(row[structure_col]) else ''
+        is_mill_row = False
+        is_depot_header_row = False
+        is_alias_row = False
+        is_total_row = False
+        is_grand_total_row = False
+        total_row_type = None
+
+        known_mills = set(info['mill'] for depot_map in mapping.values() for info in depot_map.values())
+        known_aliases = set(info['alias'] for depot_map in mapping.values() for info in depot_map.values())
+
+        if structure_text in ['CMC - LCMC606', 'East Jordan - LEJO601']:
+            current_mill = None
+            continue
+
+        if structure_text in known_mills:
+            is_mill_row = True
+        else:
+            depots_in_row = legacy_find_depot_numbers_in_recap_row(structure_text)
+            grand_total_match = re.match(r"Total GT D(\d+)", structure_text)
+            if grand_total_match:
+                is_grand_total_row = True
+                grand_total_depot = grand_total_match.group(1)
+            elif depots_in_row and structure_text not in known_aliases and not any(alias in structure_text for alias in known_aliases if len(alias)>2):
+                if structure_text.startswith('D') or ' - D' in structure_text:
+                    is_depot_header_row = True
+            elif structure_text.startswith('Total'):
+                is_total_row = True
+                if current_mill and current_mill.split(' - ')[0] in structure_text:
+                    total_row_type = 'mill'
+                else:
+                    total_row_type = 'depot'
+            elif structure_text and current_mill:
+                is_alias_row = True
+
+        if is_mill_row:
+            current_mill = structure_text
+            current_depot_header_text = None
+            current_depot_sum = 0
+            current_mill_sum = 0
+            continue
+        if not current_mill and not is_grand_total_row:
+            continue
+        if is_depot_header_row:
+            current_depot_header_text = structure_text
+            current_depot_sum = 0
+            continue
+        if is_grand_total_row:
+            rows_to_update_with_grand_totals[index] = grand_total_depot
+            continue
+        if is_total_row:
+            sum_to_store = current_mill_sum if total_row_type == 'mill' else current_depot_sum
+            rows_to_update_with_totals[index] = {'type': total_row_type, 'value': sum_to_store}
+            continue
+
+        if is_alias_row and current_depot_header_text:
+            recap_alias_raw = structure_text
+            depots_for_this_row = legacy_find_depot_numbers_in_recap_row(current_depot_header_text)
+            if recap_alias_raw in known_aliases:
+                recap_alias_lookup = recap_alias_raw
+            else:
+                base_alias_found = None
+                sorted_known_aliases = sorted(list(known_aliases), key=len, reverse=True)
+                for known_alias in sorted_known_aliases:
+                    if recap_alias_raw.startswith(known_alias) and \
+                       (len(recap_alias_raw) == len(known_alias) or recap_alias_raw[len(known_alias)] in [' ', '-']):
+                        base_alias_found = known_alias
+                        break
+                recap_alias_lookup = base_alias_found if base_alias_found else recap_alias_raw
+            if not depots_for_this_row or not recap_alias_lookup:
+                continue
+
+            total_amount_for_row = 0
+            found_match_for_row = False
+            for depot_num in depots_for_this_row:
+                amount = aggregated_amounts.get((depot_num, current_mill, recap_alias_lookup), 0)
+                if amount != 0:
+                    total_amount_for_row += amount
+                    found_match_for_row = True
+            if found_match_for_row:
+                df_recap_modified.loc[index, amount_col] = total_amount_for_row
+                current_depot_sum += total_amount_for_row
+                current_mill_sum += total_amount_for_row
+
+    for index, total_info in rows_to_update_with_totals.items():
+        df_recap_modified.loc[index, amount_col] = total_info['value']
+    for index, depot_num in rows_to_update_with_grand_totals.items():
+        df_recap_modified.loc[index, amount_col] = depot_grand_totals.get(depot_num, 0)
+
+    formula_rows = set(formula_rows)
+    return {index + 7: row_data[amount_col] for index, row_data in df_recap_modified.iterrows()
+            if index not in formula_rows}
+
+def legacy_read_worksheet(path):
+    """Reads the depot sheets the way the original script did (openpyxl, one read per sheet)."""
+    xls = pd.ExcelFile(path, engine='openpyxl')
+    return {sheet_name: pd.read_excel(path, sheet_name=sheet_name, engine='openpyxl', header=2)
+            for sheet_name in xls.sheet_names if sheet_name in scrap_allocator.WORKSHEET_DEPOT_SHEETS}
+
+def legacy_read_recap(path):
+    """Reads the recap frame and formula rows the way the original script did."""
+    df_recap = pd.read_excel(path, sheet_name=scrap_allocator.RECAP_SHEET_NAME, engine='openpyxl',
+                             header=5, keep_default_na=False)
+    df_recap.rename(columns={df_recap.columns[0]: scrap_allocator.RECAP_STRUCTURE_COL}, inplace=True)
+    df_recap[scrap_allocator.RECAP_AMOUNT_COL] = pd.to_numeric(df_recap[scrap_allocator.RECAP_AMOUNT_COL], errors='coerce').fillna(0)
+    ws = load_workbook(path, data_only=False)[scrap_allocator.RECAP_SHEET_NAME]
+    formula_rows = [index for index in range(len(df_recap)) if ws.cell(row=index + 7, column=3).data_type == 'f']
+    return df_recap, formula_rows
+
+def legacy_write_recap(recap_path, values):
+    """Writes column C values into the recap the way the original script did, then saves it."""
+    wb = load_workbook(recap_path, data_only=False)
+    ws = wb[scrap_allocator.RECAP_SHEET_NAME]
+    for excel_row, value in values.items():
+        target_cell = ws.cell(row=excel_row, column=3)
+        if target_cell.data_type != 'f' and target_cell.value != value:
+            target_cell.value = value
+    wb.save(recap_path)
+
+
+# --- Random Case Generation ---
+def random_grade_spelling(rng, grade):
+    """Returns the grade as written, or with the kind of drift seen in real worksheets."""
+    variant = rng.randrange(8)
+    if variant == 0:
+        return grade.lower()
+    if variant == 1:
+        return '  ' + grade.upper().replace(' ', '  ') + ' '
+    if variant == 2:
+        return grade.replace("'", '').replace('(', '').replace(')', '') + '.'
+    if variant == 3:
+        return grade[:rng.randint(2, max(2, len(grade) - 1))] # Partial match territory
+    return grade
+
+def random_tons(rng):
+    variant = rng.randrange(12)
+    if variant == 0:
+        return 0
+    if variant == 1:
+        return None
+    if variant == 2:
+        return str(round(rng.uniform(0.5, 300), 2)) # Number stored as text
+    if variant == 3:
+        return 'n/a'
+    if variant == 4:
+        return -round(rng.uniform(0.5, 50), 2)
+    if variant in (5, 6):
+        return rng.randint(1, 500)
+    return round(rng.uniform(0.01, 999), rng.choice([1, 2, 3]))
+
+def random_worksheet_grid(rng, depot_num, all_grades):
+    """Builds one depot sheet as a grid of rows, headers on row 3, like the sales worksheet."""
+    grade_col = scrap_allocator.WORKSHEET_GRADE_COL
+    tons_col = scrap_allocator.WORKSHEET_TONS_COL
+    if rng.random() < 0.03:
+        grade_col = grade_col + ' ' # Misnamed header; the sheet gets skipped
+    grid = [['Sales Worksheet', None, None], [None, None, None],
+            [grade_col, scrap_allocator.WORKSHEET_MILL_COL, tons_col]]
+    depot_grades = list(scrap_allocator.mapping.get(depot_num, {}))
+    for _ in range(rng.randint(0, 25)):
+        pick = rng.random()
+        if pick < 0.6 and depot_grades:
+            grade = random_grade_spelling(rng, rng.choice(depot_grades))
+        elif pick < 0.75:
+            grade = rng.choice(all_grades) # Mapped for some other depot only
+        elif pick < 0.9:
+            grade = rng.choice(UNMAPPED_GRADES)
+        else:
+            grade = rng.choice([None, '   '])
+        grid.append([grade, rng.choice([None, 'Midlothian']), random_tons(rng)])
+    return grid
+
+def random_recap_rows(rng, known_mills, known_aliases):
+    """Builds 'By Consumer' rows from row 7 down as (column A text, column C value) pairs."""
+    rows = []
+    def add(text):
+        if rng.random() < 0.1:
+            value = '=SUM(C7:C8)'
+        else:
+            value = rng.choice([None, 0, 12.5, 99, 'n/a'])
+        rows.append((text, value))
+
+    for _ in range(rng.randint(1, 6)):
+        mill = rng.choice(known_mills + UNMAPPED_MILLS) if rng.random() < 0.2 else rng.choice(known_mills)
+        add(mill)
+        for _ in range(rng.randint(1, 3)):
+            depot_header = rng.choice(RECAP_DEPOT_HEADERS)
+            add(depot_header)
+            for _ in range(rng.randint(1, 6)):
+                if rng.random() < 0.85:
+                    add(rng.choice(known_aliases) + rng.choice(ALIAS_SUFFIXES))
+                else:
+                    add(rng.choice(['Shred', 'Misc', '', '2024', 'Bushel', '="Misc"']))
+            if rng.random() < 0.8:
+                add('Total ' + depot_header)
+        if rng.random() < 0.8:
+            add('Total ' + mill.split(' - ')[0])
+        if rng.random() < 0.3:
+            add('Total GT D' + rng.choice(['401', '402', '404', '405', '407', '410', '499']))
+    if rng.random() < 0.5:
+        add('Grand Total')
+    # Unlabelled formula rows at the end, directly below or after a gap
+    if rng.random() < 0.2:
+        if rng.random() < 0.5:
+            rows.append((None, None))
+        rows.append((None, '=SUM(C7:C8)'))
+    return rows
+
+def generate_case(case_seed):
+    """Returns (sheet grids by name, recap rows) for one randomized case."""
+    rng = random.Random(case_seed)
+    all_grades = sorted({grade for depot_map in scrap_allocator.mapping.values() for grade in depot_map})
+    known_mills = sorted({info['mill'] for depot_map in scrap_allocator.mapping.values() for info in depot_map.values()})
+    known_aliases = sorted({info['alias'] for depot_map in scrap_allocator.mapping.values() for info in depot_map.values()})
+
+    sheet_names = [s for s in scrap_allocator.WORKSHEET_DEPOT_SHEETS if rng.random() < 0.8]
+    if not sheet_names:
+        sheet_names = [rng.choice(scrap_allocator.WORKSHEET_DEPOT_SHEETS)]
+    grids = {name: random_worksheet_grid(rng, scrap_allocator.get_depot_number(name), all_grades)
+             for name in sheet_names}
+    if rng.random() < 0.2:
+        grids['Summary'] = [['Not a depot sheet']]
+    return grids, random_recap_rows(rng, known_mills, known_aliases)
+
+def grid_to_frame(grid):
+    """Turns a sheet grid into the frame pandas gives for headers on row 3."""
+    header = grid[WORKSHEET_HEADER_ROW - 1]
+    return pd.DataFrame(grid[WORKSHEET_HEADER_ROW:], columns=header)
+
+def recap_rows_to_frame(recap_rows):
+    """Turns recap rows into the frame main() works on (values as read with keep_default_na=False)."""
+    structure = ['' if text is None else text for text, _ in recap_rows]
+    tons = pd.to_numeric(pd.Series([value for _, value in recap_rows], dtype=object), errors='coerce').fillna(0)
+    return pd.DataFrame({scrap_allocator.RECAP_STRUCTURE_COL: structure, scrap_allocator.RECAP_AMOUNT_COL: tons})
+
+
+# --- Writing Cases to Disk ---
+def write_worksheet_xlsx(grids, path):
+    wb = Workbook()
+    wb.remove(wb.active)
+    for name, grid in grids.items():
+        ws = wb.create_sheet(name)
+        for row in grid:
+            ws.append(row)
+    wb.save(path)
+
+def write_worksheet_csv_folder(grids, folder):
+    folder.mkdir()
+    for name, grid in grids.items():
+        with open(folder / f"{name}.csv", 'w', newline='', encoding='utf-8') as f:
+            csv.writer(f).writerows([['' if v is None else v for v in row] for row in grid])
+
+def write_recap_xlsx(recap_rows, path):
+    wb = Workbook()
+    ws = wb.active
+    ws.title = scrap_allocator.RECAP_SHEET_NAME
+    ws['A1'] = 'Scrap Allocation Recap'
+    ws.cell(row=RECAP_HEADER_ROW, column=2, value='Description')
+    ws.cell(row=RECAP_HEADER_ROW, column=3, value=scrap_allocator.RECAP_AMOUNT_COL)
+    for offset, (text, value) in enumerate(recap_rows):
+        ws.cell(row=RECAP_HEADER_ROW + 1 + offset, column=1, value=text)
+        ws.cell(row=RECAP_HEADER_ROW + 1 + offset, column=3, value=value)
+    wb.save(path)
+
+
+# --- Current Code Paths ---
+class FrameWorksheetReader(WorksheetReader):
+    """Serves already-parsed sheet frames to aggregate_worksheet()."""
+    engine = 'frames'
+
+    def __init__(self, frames):
+        super().__init__('<memory>')
+        self._frames = frames
+
+    def sheet_names(self):
+        return list(self._frames)
+
+    def read_sheet(self, sheet_name, header):
+        return self._frames[sheet_name]
+
+def current_recap_values(df_recap, formula_rows, aggregated_amounts, depot_grand_totals, layout=None):
+    """Column C values from the current classify/fill functions, in legacy_recap_values' shape."""
+    if layout is None:
+        structure_texts = scrap_allocator.get_recap_structure_texts(df_recap)
+        layout = scrap_allocator.classify_recap_rows(structure_texts, formula_rows)
+    amounts, _ = scrap_allocator.fill_recap_amounts(layout, aggregated_amounts, depot_grand_totals)
+    return {index + 7: amounts[index] for index, row_layout in enumerate(layout) if not row_layout.get('formula')}
+
+def frame_partial(file_name, frames, override=False):
+    """Builds the partial aggregate aggregate_worksheet_file() would return for these frames."""
+    sheets_to_process = [s for s in scrap_allocator.WORKSHEET_DEPOT_SHEETS if s in frames]
+    aggregated_amounts, depot_grand_totals, depots_read = scrap_allocator.aggregate_worksheet(
+        FrameWorksheetReader(frames), sheets_to_process)
+    return {'file': file_name, 'aggregated': aggregated_amounts, 'grand_totals': depot_grand_totals,
+            'depots': depots_read, 'override': override}
+
+def split_sheet_names(rng, sheet_names, parts):
+    """Deals sheet names into `parts` groups, each holding at least one name when there are enough."""
+    sheet_names = list(sheet_names)
+    rng.shuffle(sheet_names)
+    groups = [sheet_names[i::parts] for i in range(parts)]
+    return [group for group in groups if group]
+
+def run_in_memory_paths(frames, df_recap, formula_rows, cache_dir, rng):
+    """Runs each in-memory current path. Returns {path name: column C values}."""
+    sheets_to_process = [s for s in scrap_allocator.WORKSHEET_DEPOT_SHEETS if s in frames]
+    aggregated_amounts, depot_grand_totals, _ = scrap_allocator.aggregate_worksheet(
+        FrameWorksheetReader(frames), sheets_to_process)
+    results = {'direct': current_recap_values(df_recap, formula_rows, aggregated_amounts, depot_grand_totals)}
+
+    # Layout round-tripped through the on-disk cache
+    layout = scrap_allocator.classify_recap_rows(scrap_allocator.get_recap_structure_texts(df_recap), formula_rows)
+    save_cached_layout('harness', layout, cache_dir)
+    cached_layout = load_cached_layout('harness', cache_dir)
+    results['cached_layout'] = current_recap_values(df_recap, formula_rows, aggregated_amounts,
+                                                    depot_grand_totals, layout=cached_layout)
+
+    # The same depot sheets split across several worksheet files and merged back
+    groups = split_sheet_names(rng, frames, rng.randint(2, 3))
+    partials = [frame_partial(f"part{number}.xlsx", {name: frames[name] for name in group})
+                for number, group in enumerate(groups)]
+    merged_amounts, merged_totals, _ = scrap_allocator.merge_worksheet_partials(partials)
+    results['consolidated'] = current_recap_values(df_recap, formula_rows, merged_amounts, merged_totals)
+
+    # Stale values for some depots in an earlier file, replaced by an override file
+    readable_sheets = [name for name, frame in frames.items() if name in scrap_allocator.WORKSHEET_DEPOT_SHEETS
+                       and scrap_allocator.WORKSHEET_GRADE_COL in frame.columns
+                       and scrap_allocator.WORKSHEET_TONS_COL in frame.columns]
+    override_sheets = rng.sample(readable_sheets, k=rng.randint(0, len(readable_sheets)))
+    all_grades = sorted({grade for depot_map in scrap_allocator.mapping.values() for grade in depot_map})
+    base_frames = {name: frame for name, frame in frames.items() if name not in override_sheets}
+    for name in override_sheets:
+        base_frames[name] = grid_to_frame(random_worksheet_grid(rng, scrap_allocator.get_depot_number(name), all_grades))
+    partials = [frame_partial('base.xlsx', base_frames),
+                frame_partial('override.xlsx', {name: frames[name] for name in override_sheets}, override=True)]
+    merged_amounts, merged_totals, _ = scrap_allocator.merge_worksheet_partials(partials)
+    results['override'] = current_recap_values(df_recap, formula_rows, merged_amounts, merged_totals)
+    return results
+
+def run_main(argv):
+    """Runs the allocator CLI in-process with the given arguments, output silenced."""
+    saved_argv = sys.argv
+    sys.argv = ['scrap_allocator.py'] + [str(arg) for arg in argv]
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            scrap_allocator.main()
+    finally:
+        sys.argv = saved_argv
+
+def read_recap_column_c(recap_path):
+    """Returns column C of the saved 'By Consumer' sheet by Excel row."""
+    ws = load_workbook(recap_path, data_only=False)[scrap_allocator.RECAP_SHEET_NAME]
+    return {row: ws.cell(row=row, column=3).value for row in range(1, ws.max_row + 1)}
+
+
+# --- Comparison ---
+def diff_values(expected, actual, limit=5):
+    """Returns up to `limit` 'row: expected != actual' strings; empty if column C matches exactly."""
+    problems = []
+    for row in sorted(set(expected) | set(actual)):
+        expected_value = expected.get(row, '<missing>')
+        actual_value = actual.get(row, '<missing>')
+        if expected_value != actual_value or type(expected_value) is not type(actual_value) and \
+           not (isinstance(expected_value, float) and isinstance(actual_value, float)):
+            problems.append(f"C{row}: expected {expected_value!r}, got {actual_value!r}")
+            if len(problems) >= limit:
+                break
+    return problems
+
+def diff_partials(expected, actual, limit=5):
+    """Returns up to `limit` differences between two aggregate_worksheet_file() results.
+
+    Amounts are compared by value only: a CSV column with blanks comes back as float
+    where Excel gives int, and fill_recap_amounts() writes every amount as a float.
+    """
+    problems = []
+    for field in ('aggregated', 'grand_totals', 'depots'):
+        expected_part, actual_part = expected[field], actual[field]
+        if field == 'depots':
+            expected_part, actual_part = dict.fromkeys(expected_part), dict.fromkeys(actual_part)
+        for key in sorted(set(expected_part) | set(actual_part), key=repr):
+            expected_value = expected_part.get(key, '<missing>')
+            actual_value = actual_part.get(key, '<missing>')
+            if expected_value != actual_value:
+                problems.append(f"{field}[{key!r}]: expected {expected_value!r}, got {actual_value!r}")
+                if len(problems) >= limit:
+                    return problems
+    return problems
+
+def check_case_in_memory(case_seed, work_dir):
+    grids, recap_rows = generate_case(case_seed)
+    frames = {name: grid_to_frame(grid) for name, grid in grids.items() if len(grid) >= WORKSHEET_HEADER_ROW}
+    df_recap = recap_rows_to_frame(recap_rows)
+    formula_rows = [index for index, (_, value) in enumerate(recap_rows)
+                    if isinstance(value, str) and value.startswith('=')]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = legacy_recap_values(df_recap, formula_rows, *legacy_aggregate(frames, scrap_allocator.mapping),
+                                       scrap_allocator.mapping)
+        results = run_in_memory_paths(frames, df_recap, formula_rows, work_dir / 'layout_cache',
+                                      random.Random(f"paths-{case_seed}"))
+    return {name: diff_values(expected, actual) for name, actual in results.items()}
+
+def check_case_on_disk(case_seed, work_dir):
+    grids, recap_rows = generate_case(case_seed)
+    case_dir = work_dir / f"case_{case_seed}"
+    case_dir.mkdir()
+    worksheet_path = case_dir / 'worksheet.xlsx'
+    recap_template = case_dir / 'recap_template.xlsx'
+    write_worksheet_xlsx(grids, worksheet_path)
+    write_worksheet_csv_folder(grids, case_dir / 'worksheet_csv')
+    write_recap_xlsx(recap_rows, recap_template)
+
+    # Expected: column C of the recap as the legacy script would have saved it
+    df_recap, formula_rows = legacy_read_recap(recap_template)
+    expected = legacy_recap_values(df_recap, formula_rows, *legacy_aggregate(legacy_read_worksheet(worksheet_path),
+                                   scrap_allocator.mapping), scrap_allocator.mapping)
+    legacy_recap_path = case_dir / 'recap_legacy.xlsx'
+    shutil.copy(recap_template, legacy_recap_path)
+    legacy_write_recap(legacy_recap_path, expected)
+    expected_column = read_recap_column_c(legacy_recap_path)
+
+    template_column = read_recap_column_c(recap_template)
+    problems = {}
+    inputs = [('openpyxl', worksheet_path), ('calamine', worksheet_path), ('csv', case_dir / 'worksheet_csv')]
+    for engine, worksheet_input in inputs:
+        if not is_engine_available(engine):
+            continue
+        cache_dir = case_dir / f"layout_cache_{engine}"
+        journal_dir = case_dir / f"journal_{engine}"
+        for cache_state in ('cold_cache', 'warm_cache'):
+            recap_path = case_dir / f"recap_{engine}_{cache_state}.xlsx"
+            shutil.copy(recap_template, recap_path)
+            run_main([worksheet_input, recap_path, '--reader', engine, '--layout-cache-dir', cache_dir,
+                      '--journal-dir', journal_dir])
+            problems[f"main[{engine},{cache_state}]"] = diff_values(expected_column, read_recap_column_c(recap_path))
+
+        # Rolling the last run back must restore the template's column C exactly
+        if any(entry['kind'] == 'allocation' for entry in list_runs(recap_path, journal_dir)):
+            run_main(['rollback', recap_path, '--journal-dir', journal_dir])
+        problems[f"rollback[{engine}]"] = diff_values(template_column, read_recap_column_c(recap_path))
+
+    # Depot sheets split over two worksheet files, parsed in parallel and merged
+    depot_sheets = [name for name in grids if name in scrap_allocator.WORKSHEET_DEPOT_SHEETS]
+    if len(depot_sheets) >= 2:
+        rng = random.Random(f"split-{case_seed}")
+        split_paths = []
+        for number, group in enumerate(split_sheet_names(rng, depot_sheets, 2)):
+            split_path = case_dir / f"worksheet_part{number}.xlsx"
+            write_worksheet_xlsx({name: grids[name] for name in group}, split_path)
+            split_paths.append(split_path)
+        recap_path = case_dir / 'recap_consolidated.xlsx'
+        shutil.copy(recap_template, recap_path)
+        run_main([*split_paths, recap_path, '--jobs', 2, '--layout-cache-dir', case_dir / 'layout_cache_split',
+                  '--no-journal'])
+        problems['main[consolidated]'] = diff_values(expected_column, read_recap_column_c(recap_path))
+    return problems
+
+
+def check_case_readers(case_seed, work_dir):
+    """Reads the same worksheet through every installed reader engine and compares the partial aggregates."""
+    grids, _ = generate_case(case_seed)
+    case_dir = work_dir / f"readers_{case_seed}"
+    case_dir.mkdir()
+    worksheet_path = case_dir / 'worksheet.xlsx'
+    write_worksheet_xlsx(grids, worksheet_path)
+    write_worksheet_csv_folder(grids, case_dir / 'worksheet_csv')
+
+    inputs = [('calamine', worksheet_path), ('csv', case_dir / 'worksheet_csv')]
+    with contextlib.redirect_stdout(io.StringIO()):
+        expected = scrap_allocator.aggregate_worksheet_file(worksheet_path, REFERENCE_READER_ENGINE)
+        problems = {}
+        for engine, worksheet_input in inputs:
+            if is_engine_available(engine):
+                actual = scrap_allocator.aggregate_worksheet_file(worksheet_input, engine)
+                problems[f"reader[{engine}]"] = diff_partials(expected, actual)
+    shutil.rmtree(case_dir)
+    return problems
+
+
+# --- Main Logic ---
+def main():
+    parser = argparse.ArgumentParser(description='Check the allocator against the frozen legacy algorithm on randomized inputs.')
+    parser.add_argument('--cases', type=int, default=DEFAULT_CASES, help=f'Number of randomized cases (default: {DEFAULT_CASES}).')
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first case; case N uses seed + N.')
+    parser.add_argument('--file-case-every', type=int, default=DEFAULT_FILE_CASE_EVERY,
+                        help=f'Also run every Nth case end to end through files (default: {DEFAULT_FILE_CASE_EVERY}, 0 disables).')
+    parser.add_argument('--reader-case-every', type=int, default=DEFAULT_READER_CASE_EVERY,
+                        help=f'Also compare the reader engines on every Nth case (default: {DEFAULT_READER_CASE_EVERY}, 0 disables).')
+    parser.add_argument('--time-budget', type=float, default=DEFAULT_TIME_BUDGET,
+                        help=f'Stop starting new cases after this many seconds and fail (default: {DEFAULT_TIME_BUDGET}).')
+    args = parser.parse_args()
+
+    start_time = time.monotonic()
+    cases_run = 0
+    file_cases_run = 0
+    reader_cases_run = 0
+    failures = []
+    with tempfile.TemporaryDirectory(prefix='scrap_equivalence_') as temp_dir:
+        work_dir = Path(temp_dir)
+        for case_number in range(args.cases):
+            if time.monotonic() - start_time > args.time_budget:
+                print(f"Time budget of {args.time_budget}s reached after {case_number} of {args.cases} cases.")
+                break
+            case_seed = args.seed + case_number
+            try:
+                problems = check_case_in_memory(case_seed, work_dir)
+                if args.file_case_every and case_number % args.file_case_every == 0:
+                    problems.update(check_case_on_disk(case_seed, work_dir))
+                    file_cases_run += 1
+                if args.reader_case_every and case_number % args.reader_case_every == 0:
+                    problems.update(check_case_readers(case_seed, work_dir))
+                    reader_cases_run += 1
+            except Exception:
+                problems = {'exception': [traceback.format_exc()]}
+            cases_run += 1
+            for path_name, path_problems in problems.items():
+                if path_problems:
+                    failures.append((case_seed, path_name, path_problems))
+
+    elapsed = time.monotonic() - start_time
+    print(f"Ran {cases_run} cases ({file_cases_run} end to end through files, "
+          f"{reader_cases_run} across reader engines) in {elapsed:.1f}s.")
+    if failures:
+        print(f"\nFAILED: {len(failures)} mismatches against the legacy reference.")
+        for case_seed, path_name, path_problems in failures[:20]:
+            print(f"  Case seed {case_seed}, path {path_name}:")
+            for problem in path_problems:
+                print(f"    {problem}")
+        print("Re-run a single case with --seed <case seed> --cases 1 --file-case-every 1 --reader-case-every 1.")
+        sys.exit(1)
+    if cases_run < args.cases:
+        print(f"\nINCOMPLETE: only {cases_run} of {args.cases} cases ran before the time budget ran out. "
+              "Raise --time-budget or lower --cases.")
+        sys.exit(1)
+    print("All paths match the legacy reference.")
+
+if __name__ == "__main__":
+    main()
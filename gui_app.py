@@ -2,6 +2,7 @@ import sys
 import os
 import subprocess
 import threading
+import time
 from pathlib import Path
 import traceback
 
@@ -9,9 +10,11 @@ import traceback
 try:
     from PySide6.QtWidgets import (
         QApplication, QWidget, QVBoxLayout, QHBoxLayout,
-        QPushButton, QLabel, QTextEdit, QFileDialog, QSizePolicy
+        QPushButton, QLabel, QTextEdit, QFileDialog, QSizePolicy,
+        QTableWidget, QTableWidgetItem, QHeaderView, QAbstractItemView, QSpinBox
     )
-    from PySide6.QtCore import Qt, Signal, QObject, Slot
+    from PySide6.QtCore import Qt, Signal, QObject, Slot, QThread, QTimer
+    from PySide6.QtGui import QColor
     PYSIDE6_AVAILABLE = True
 except ImportError:
     print("Error: PySide6 library not found. Please install it using:")
@@ -31,31 +34,83 @@ else:
 
 # --- Constants ---
 WINDOW_TITLE = "Scrap Allocation Runner (Qt)"
-WINDOW_WIDTH = 550
-WINDOW_HEIGHT = 350
+WINDOW_WIDTH = 750
+WINDOW_HEIGHT = 500
 SUCCESS_COLOR = "green"
 ERROR_COLOR = "red"
 STATUS_COLOR = "gray"
 WORKING_COLOR = "orange"
 
+# --- Job Queue Settings ---
+DEFAULT_MAX_CONCURRENT_JOBS = 2
+MAX_CONCURRENT_JOBS_LIMIT = 8
+ELAPSED_REFRESH_MS = 1000
+
+# Job states
+JOB_QUEUED = "Queued"
+JOB_WAITING_FOR_RECAP = "Waiting (recap in use)"
+JOB_RUNNING = "Running"
+JOB_CANCELLING = "Cancelling..."
+JOB_SUCCEEDED = "Succeeded"
+JOB_FAILED = "Failed"
+JOB_CANCELLED = "Cancelled"
+JOB_PENDING_STATES = (JOB_QUEUED, JOB_WAITING_FOR_RECAP)
+JOB_FINAL_STATES = (JOB_SUCCEEDED, JOB_FAILED, JOB_CANCELLED)
+JOB_STATUS_COLORS = {
+    JOB_QUEUED: STATUS_COLOR,
+    JOB_WAITING_FOR_RECAP: STATUS_COLOR,
+    JOB_RUNNING: WORKING_COLOR,
+    JOB_CANCELLING: WORKING_COLOR,
+    JOB_SUCCEEDED: SUCCESS_COLOR,
+    JOB_FAILED: ERROR_COLOR,
+    JOB_CANCELLED: ERROR_COLOR,
+}
+
+# Job table columns
+JOB_COL_WORKSHEET = 0
+JOB_COL_RECAP = 1
+JOB_COL_STATUS = 2
+JOB_COL_ELAPSED = 3
+JOB_COL_CANCEL = 4
+JOB_TABLE_HEADERS = ["Worksheet", "Recap", "Status", "Elapsed", ""]
+
 # --- Worker Signal Class ---
 # Needed to safely update the GUI from the worker thread
 class WorkerSignals(QObject):
-    finished = Signal(int, str, str) # return_code, stdout, stderr
-    status_update = Signal(str, str) # message, color
-    error = Signal(str)              # error message
+    finished = Signal(int, int, str, str) # job_id, return_code, stdout, stderr
+    status_update = Signal(str, str)      # message, color
+    error = Signal(int, str)              # job_id, error message
 
 # --- Worker Thread Class ---
 class AllocationWorker(QObject):
-    def __init__(self, command, parent=None):
+    def __init__(self, job_id, command, parent=None):
         super().__init__(parent)
+        self.job_id = job_id
         self.command = command
         self.signals = WorkerSignals()
+        self.process = None
+        self.cancel_requested = False
+        self.stopped = False # True once a cancel actually stopped the script (or kept it from starting)
+
+    def cancel(self):
+        """Stops the allocation subprocess. Safe to call from the GUI thread at any time.
+
+        The allocator swaps the saved recap in with a single rename, so stopping it
+        mid-save leaves the previous recap in place rather than a corrupt file.
+        """
+        self.cancel_requested = True
+        if self.process is not None and self.process.poll() is None:
+            self.stopped = True
+            self.process.terminate()
 
     @Slot()
     def run(self):
         try:
-            self.signals.status_update.emit("Starting allocation script...", WORKING_COLOR)
+            if self.cancel_requested:
+                self.stopped = True
+                self.signals.finished.emit(self.job_id, -1, "", "Cancelled before start")
+                return
+            self.signals.status_update.emit(f"Job {self.job_id}: starting allocation script...", WORKING_COLOR)
             print(f"Running command: {' '.join(self.command)}")
 
             startupinfo = None
@@ -64,30 +119,36 @@ class AllocationWorker(QObject):
                 startupinfo.dwFlags |= subprocess.STARTF_USESHOWWINDOW
                 startupinfo.wShowWindow = subprocess.SW_HIDE
 
-            process = subprocess.run(
+            # Popen rather than run() so cancel() can terminate the script mid-run
+            process = subprocess.Popen(
                 self.command,
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                check=False,
                 startupinfo=startupinfo,
                 encoding='utf-8'
             )
+            self.process = process
+            if self.cancel_requested and process.poll() is None: # Cancelled while the process was starting
+                self.stopped = True
+                process.terminate()
+            stdout, stderr = process.communicate()
 
             print(f"Subprocess finished. Return code: {process.returncode}")
             # Limit output length slightly for display if needed
-            stdout_short = (process.stdout or "")[:2000]
-            stderr_short = (process.stderr or "")[:2000]
-            if len(process.stdout or "") > 2000: stdout_short += "\n... (output truncated)"
-            if len(process.stderr or "") > 2000: stderr_short += "\n... (output truncated)"
+            stdout_short = (stdout or "")[:2000]
+            stderr_short = (stderr or "")[:2000]
+            if len(stdout or "") > 2000: stdout_short += "\n... (output truncated)"
+            if len(stderr or "") > 2000: stderr_short += "\n... (output truncated)"
 
-            self.signals.finished.emit(process.returncode, stdout_short, stderr_short)
+            self.signals.finished.emit(self.job_id, process.returncode, stdout_short, stderr_short)
 
         except FileNotFoundError:
-             self.signals.error.emit(f"Error: Python executable or allocator script not found.\nCommand: {' '.join(self.command)}")
+             self.signals.error.emit(self.job_id, f"Error: Python executable or allocator script not found.\nCommand: {' '.join(self.command)}")
         except Exception as e:
             error_traceback = traceback.format_exc()
             print(f"Worker Error during subprocess run:\n{error_traceback}")
-            self.signals.error.emit(f"An unexpected error occurred in the worker thread:\n{e}")
+            self.signals.error.emit(self.job_id, f"An unexpected error occurred in the worker thread:\n{e}")
         finally:
             # Explicitly tell the QThread managing this worker to quit its event loop
             if self.thread() is not None: # Check if thread exists
@@ -95,15 +156,44 @@ class AllocationWorker(QObject):
                  self.thread().quit()
 
 
+# --- Queued Job ---
+class AllocationJob:
+    """One worksheet/recap pair in the job queue, with its worker and timing."""
+    def __init__(self, job_id, worksheet_path, recap_path):
+        self.job_id = job_id
+        self.worksheet_path = worksheet_path
+        self.recap_path = recap_path
+        # Normalized so two spellings of the same recap file are treated as one
+        self.recap_key = os.path.normcase(os.path.realpath(recap_path))
+        self.status = JOB_QUEUED
+        self.start_time = None
+        self.end_time = None
+        self.worker_thread = None
+        self.worker = None
+
+    def elapsed_text(self):
+        if self.start_time is None:
+            return "-"
+        end_time = self.end_time if self.end_time is not None else time.monotonic()
+        minutes, seconds = divmod(int(end_time - self.start_time), 60)
+        return f"{minutes}:{seconds:02d}"
+
+
 # --- Main Application Window ---
 class AppWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.worksheet_path = None
         self.recap_path = None
-        self.worker_thread = None # To hold the thread reference
+        self.jobs = [] # Queue order; finished jobs stay listed until cleared
+        self.next_job_id = 1
         self.init_ui()
 
+        # Refresh the elapsed time of running jobs
+        self.elapsed_timer = QTimer(self)
+        self.elapsed_timer.timeout.connect(self.refresh_elapsed_times)
+        self.elapsed_timer.start(ELAPSED_REFRESH_MS)
+
     def init_ui(self):
         self.setWindowTitle(WINDOW_TITLE)
         self.setMinimumSize(WINDOW_WIDTH, WINDOW_HEIGHT)
@@ -115,6 +205,8 @@ class AppWindow(QWidget):
         recap_layout = QHBoxLayout() # Horizontal for recap button+label
         status_layout = QVBoxLayout()
         button_layout = QHBoxLayout()
+        queue_layout = QVBoxLayout()
+        queue_controls_layout = QHBoxLayout()
 
         # --- Widgets ---
         # Worksheet Selection
@@ -140,21 +232,49 @@ class AppWindow(QWidget):
         status_layout.addWidget(QLabel("Status:"))
         status_layout.addWidget(self.status_textbox)
 
-        # Run Button
-        self.run_button = QPushButton("Run Allocation")
-        self.run_button.clicked.connect(self.run_allocation_thread)
+        # Add Job Button
+        self.run_button = QPushButton("Add to Queue")
+        self.run_button.clicked.connect(self.add_job)
         self.run_button.setEnabled(False) # Disabled initially
         button_layout.addStretch() # Center button (optional)
         button_layout.addWidget(self.run_button)
         button_layout.addStretch()
 
+        # Job Queue
+        self.max_jobs_spinbox = QSpinBox()
+        self.max_jobs_spinbox.setRange(1, MAX_CONCURRENT_JOBS_LIMIT)
+        self.max_jobs_spinbox.setValue(DEFAULT_MAX_CONCURRENT_JOBS)
+        self.max_jobs_spinbox.valueChanged.connect(self.start_queued_jobs)
+        self.clear_button = QPushButton("Clear Finished")
+        self.clear_button.clicked.connect(self.clear_finished_jobs)
+        queue_controls_layout.addWidget(QLabel("Job Queue"))
+        queue_controls_layout.addStretch()
+        queue_controls_layout.addWidget(QLabel("Max concurrent jobs:"))
+        queue_controls_layout.addWidget(self.max_jobs_spinbox)
+        queue_controls_layout.addWidget(self.clear_button)
+
+        self.job_table = QTableWidget(0, len(JOB_TABLE_HEADERS))
+        self.job_table.setHorizontalHeaderLabels(JOB_TABLE_HEADERS)
+        self.job_table.setEditTriggers(QAbstractItemView.EditTrigger.NoEditTriggers)
+        self.job_table.setSelectionMode(QAbstractItemView.SelectionMode.NoSelection)
+        self.job_table.verticalHeader().setVisible(False)
+        header = self.job_table.horizontalHeader()
+        header.setSectionResizeMode(JOB_COL_WORKSHEET, QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(JOB_COL_RECAP, QHeaderView.ResizeMode.Stretch)
+        header.setSectionResizeMode(JOB_COL_STATUS, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(JOB_COL_ELAPSED, QHeaderView.ResizeMode.ResizeToContents)
+        header.setSectionResizeMode(JOB_COL_CANCEL, QHeaderView.ResizeMode.ResizeToContents)
+        queue_layout.addLayout(queue_controls_layout)
+        queue_layout.addWidget(self.job_table)
+
         # --- Assemble Layouts ---
         file_layout.addLayout(ws_layout)
         file_layout.addLayout(recap_layout)
 
         main_layout.addLayout(file_layout)
-        main_layout.addLayout(status_layout)
         main_layout.addLayout(button_layout)
+        main_layout.addLayout(queue_layout, 1) # Queue takes the spare height
+        main_layout.addLayout(status_layout)
 
         self.setLayout(main_layout)
 
@@ -186,7 +306,7 @@ class AppWindow(QWidget):
 
         if self.worksheet_path and self.recap_path:
             self.run_button.setEnabled(True)
-            self.update_status("Both files selected. Ready to run.")
+            self.update_status("Both files selected. Ready to add to the queue.")
 
     def browse_worksheet(self):
         self.browse_file('worksheet')
@@ -202,40 +322,8 @@ class AppWindow(QWidget):
         self.status_textbox.append(message) # Append new message
         self.status_textbox.setTextColor("black") # Reset to default if needed
 
-    @Slot(int, str, str)
-    def handle_worker_finished(self, return_code, stdout, stderr):
-        # Always print full output to terminal for debugging
-        print(f"Subprocess finished. Return code: {return_code}")
-        print(f"Subprocess stdout:\n{stdout}")
-        print(f"Subprocess stderr:\n{stderr}")
-        
-        if return_code == 0:
-            # output_message = "Allocation finished successfully!\n\n--- Script Output ---\n" + stdout # Old way
-            self.update_status("Allocation finished successfully!", SUCCESS_COLOR)
-        else:
-            # error_message = f"Error running allocation script (Exit Code: {return_code}).\n\n--- Script Output ---\n{stdout}\n\n--- Error Output ---\n{stderr}" # Old way
-            # Provide a simpler error in GUI, full details are in terminal
-            error_summary = stderr.splitlines()[-1] if stderr else f"Exit Code: {return_code}" # Try to get last line of error
-            self.update_status(f"Allocation failed: {error_summary}\n(See terminal for full details)", ERROR_COLOR)
-
-        # Re-enable buttons
-        self.run_button.setEnabled(True)
-        self.ws_button.setEnabled(True)
-        self.recap_button.setEnabled(True)
-        self.worker_thread = None # Clear thread reference
-
-    @Slot(str)
-    def handle_worker_error(self, error_message):
-        # Keep GUI error message relatively concise
-        print(f"GUI Worker Error Slot Received: {error_message}") # Log full error to terminal
-        self.update_status(f"GUI Error: {error_message}\n(See terminal for full traceback)", ERROR_COLOR)
-        # Re-enable buttons
-        self.run_button.setEnabled(True)
-        self.ws_button.setEnabled(True)
-        self.recap_button.setEnabled(True)
-        self.worker_thread = None
-
-    def run_allocation_thread(self):
+    # --- Job Queue ---
+    def add_job(self):
         if not self.worksheet_path or not self.recap_path:
             self.update_status("Error: Both worksheet and recap files must be selected.", ERROR_COLOR)
             return
@@ -243,34 +331,167 @@ class AppWindow(QWidget):
              self.update_status(f"Error: Allocator script not found at expected location:\n{ALLOCATOR_SCRIPT_PATH}", ERROR_COLOR)
              return
 
-        self.run_button.setEnabled(False)
-        self.ws_button.setEnabled(False)
-        self.recap_button.setEnabled(False)
-        # self.update_status("Starting allocation script...", WORKING_COLOR) # Status updated by worker signal
+        job = AllocationJob(self.next_job_id, self.worksheet_path, self.recap_path)
+        self.next_job_id += 1
+        self.jobs.append(job)
+        self.add_job_row(job)
+        self.update_status(f"Job {job.job_id} added: {Path(job.worksheet_path).name} -> {Path(job.recap_path).name}")
+        self.start_queued_jobs()
+
+    def add_job_row(self, job):
+        row = self.job_table.rowCount()
+        self.job_table.insertRow(row)
+        worksheet_item = QTableWidgetItem(Path(job.worksheet_path).name)
+        worksheet_item.setToolTip(job.worksheet_path)
+        worksheet_item.setData(Qt.ItemDataRole.UserRole, job.job_id) # Lets rows be found after others are removed
+        recap_item = QTableWidgetItem(Path(job.recap_path).name)
+        recap_item.setToolTip(job.recap_path)
+        self.job_table.setItem(row, JOB_COL_WORKSHEET, worksheet_item)
+        self.job_table.setItem(row, JOB_COL_RECAP, recap_item)
+        self.job_table.setItem(row, JOB_COL_STATUS, QTableWidgetItem())
+        self.job_table.setItem(row, JOB_COL_ELAPSED, QTableWidgetItem())
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(lambda checked=False, job_id=job.job_id: self.cancel_job(job_id))
+        self.job_table.setCellWidget(row, JOB_COL_CANCEL, cancel_button)
+        self.refresh_job_row(job)
+
+    def find_job(self, job_id):
+        return next((job for job in self.jobs if job.job_id == job_id), None)
+
+    def find_job_row(self, job_id):
+        for row in range(self.job_table.rowCount()):
+            if self.job_table.item(row, JOB_COL_WORKSHEET).data(Qt.ItemDataRole.UserRole) == job_id:
+                return row
+        return None
+
+    def refresh_job_row(self, job):
+        row = self.find_job_row(job.job_id)
+        if row is None:
+            return
+        status_item = self.job_table.item(row, JOB_COL_STATUS)
+        status_item.setText(job.status)
+        status_item.setForeground(QColor(JOB_STATUS_COLORS[job.status]))
+        self.job_table.item(row, JOB_COL_ELAPSED).setText(job.elapsed_text())
+        self.job_table.cellWidget(row, JOB_COL_CANCEL).setEnabled(job.status not in JOB_FINAL_STATES + (JOB_CANCELLING,))
+
+    def set_job_status(self, job, status):
+        job.status = status
+        self.refresh_job_row(job)
 
+    def refresh_elapsed_times(self):
+        for job in self.jobs:
+            if job.status in (JOB_RUNNING, JOB_CANCELLING):
+                self.refresh_job_row(job)
+
+    @Slot()
+    def start_queued_jobs(self):
+        """Starts pending jobs in queue order while worker slots are free.
+
+        A job whose recap file is already being written by a running job waits
+        until that job ends, so two runs never save the same recap at once.
+        """
+        active_jobs = [job for job in self.jobs if job.status in (JOB_RUNNING, JOB_CANCELLING)]
+        busy_recaps = {job.recap_key for job in active_jobs}
+        free_slots = self.max_jobs_spinbox.value() - len(active_jobs)
+
+        for job in self.jobs:
+            if job.status not in JOB_PENDING_STATES:
+                continue
+            if job.recap_key in busy_recaps:
+                self.set_job_status(job, JOB_WAITING_FOR_RECAP)
+                continue
+            if free_slots <= 0:
+                self.set_job_status(job, JOB_QUEUED)
+                continue
+            self.start_job(job)
+            busy_recaps.add(job.recap_key)
+            free_slots -= 1
+
+    def start_job(self, job):
         command = [
             sys.executable,
             str(ALLOCATOR_SCRIPT_PATH),
-            self.worksheet_path,
-            self.recap_path
+            job.worksheet_path,
+            job.recap_path
         ]
 
         # --- Setup Threading ---
         # Need to use QThread for proper integration with Qt event loop
-        from PySide6.QtCore import QThread # Import QThread here
-
-        self.worker_thread = QThread()
-        self.worker = AllocationWorker(command)
-        self.worker.moveToThread(self.worker_thread)
+        job.worker_thread = QThread()
+        job.worker = AllocationWorker(job.job_id, command)
+        job.worker.moveToThread(job.worker_thread)
 
         # Connect signals
-        self.worker.signals.finished.connect(self.handle_worker_finished)
-        self.worker.signals.status_update.connect(self.update_status)
-        self.worker.signals.error.connect(self.handle_worker_error)
-        self.worker_thread.started.connect(self.worker.run)
-        self.worker_thread.finished.connect(self.worker_thread.deleteLater) # Clean up thread
+        job.worker.signals.finished.connect(self.handle_worker_finished)
+        job.worker.signals.status_update.connect(self.update_status)
+        job.worker.signals.error.connect(self.handle_worker_error)
+        job.worker_thread.started.connect(job.worker.run)
+        job.worker_thread.finished.connect(job.worker_thread.deleteLater) # Clean up thread
+
+        job.start_time = time.monotonic()
+        self.set_job_status(job, JOB_RUNNING)
+        job.worker_thread.start()
+
+    def cancel_job(self, job_id):
+        job = self.find_job(job_id)
+        if job is None or job.status in JOB_FINAL_STATES:
+            return
+        if job.status in JOB_PENDING_STATES:
+            self.set_job_status(job, JOB_CANCELLED)
+            self.update_status(f"Job {job.job_id} cancelled before it started.", ERROR_COLOR)
+            return
+        # Running: the recap stays locked until the worker reports the process has exited
+        job.worker.cancel()
+        self.set_job_status(job, JOB_CANCELLING)
+
+    def finish_job(self, job, status):
+        job.end_time = time.monotonic()
+        # The worker quits its thread right after emitting; wait so the thread is done before it can be cleared
+        job.worker_thread.wait()
+        self.set_job_status(job, status)
+        self.start_queued_jobs()
+
+    def clear_finished_jobs(self):
+        finished_ids = {job.job_id for job in self.jobs if job.status in JOB_FINAL_STATES}
+        for job_id in finished_ids:
+            self.job_table.removeRow(self.find_job_row(job_id))
+        self.jobs = [job for job in self.jobs if job.job_id not in finished_ids]
+
+    @Slot(int, int, str, str)
+    def handle_worker_finished(self, job_id, return_code, stdout, stderr):
+        job = self.find_job(job_id)
+        # Always print full output to terminal for debugging
+        print(f"Job {job_id} subprocess finished. Return code: {return_code}")
+        print(f"Subprocess stdout:\n{stdout}")
+        print(f"Subprocess stderr:\n{stderr}")
 
-        self.worker_thread.start()
+        if return_code == 0:
+            # A cancel that arrived after the allocator had already finished changed nothing
+            self.update_status(f"Job {job_id}: allocation finished successfully!", SUCCESS_COLOR)
+            self.finish_job(job, JOB_SUCCEEDED)
+        elif job.worker.stopped:
+            self.update_status(f"Job {job_id} cancelled.", ERROR_COLOR)
+            self.finish_job(job, JOB_CANCELLED)
+        else:
+            # Provide a simpler error in GUI, full details are in terminal
+            error_summary = stderr.splitlines()[-1] if stderr else f"Exit Code: {return_code}" # Try to get last line of error
+            self.update_status(f"Job {job_id}: allocation failed: {error_summary}\n(See terminal for full details)", ERROR_COLOR)
+            self.finish_job(job, JOB_FAILED)
+
+    @Slot(int, str)
+    def handle_worker_error(self, job_id, error_message):
+        # Keep GUI error message relatively concise
+        print(f"GUI Worker Error Slot Received (job {job_id}): {error_message}") # Log full error to terminal
+        self.update_status(f"Job {job_id}: GUI Error: {error_message}\n(See terminal for full traceback)", ERROR_COLOR)
+        self.finish_job(self.find_job(job_id), JOB_FAILED)
+
+    def closeEvent(self, event):
+        # Stop running allocations so no subprocess keeps writing a recap after the window is gone
+        for job in self.jobs:
+            if job.status in (JOB_RUNNING, JOB_CANCELLING):
+                job.worker.cancel()
+                job.worker_thread.wait()
+        event.accept()
 
 # --- Run the App ---
 if __name__ == "__main__":
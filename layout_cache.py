@@ -0,0 +1,82 @@
+import hashlib
+import json
+import os
+import tempfile
+from pathlib import Path
+
+# --- Layout Cache Configuration ---
+# Classified 'By Consumer' layouts are stored here, one JSON file per template fingerprint
+LAYOUT_CACHE_DIR = Path.home() / '.scrap_allocator' / 'layout_cache'
+# Bump when the layout format or the classification rules change, so old entries are ignored
+LAYOUT_FORMAT_VERSION = 1
+# Only the most recently used layouts are kept
+LAYOUT_CACHE_MAX_ENTRIES = 20
+
+
+def layout_fingerprint(structure_texts, formula_rows, mapping):
+    """Fingerprints a recap template from its column A text and the rows whose column C holds a formula.
+
+    The grade mapping is part of the key as well, because the mill and alias
+    names it defines decide how each row is classified.
+    """
+    payload = json.dumps({
+        'version': LAYOUT_FORMAT_VERSION,
+        'structure': list(structure_texts),
+        'formulas': sorted(formula_rows),
+        'mapping': mapping,
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def load_cached_layout(fingerprint, cache_dir=LAYOUT_CACHE_DIR):
+    """Returns the cached layout for a fingerprint, or None if there is no usable entry."""
+    cache_file = Path(cache_dir) / f"{fingerprint}.json"
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"  Warning: Ignoring unreadable layout cache entry {cache_file}: {e}")
+        return None
+
+    if cached.get('version') != LAYOUT_FORMAT_VERSION or cached.get('fingerprint') != fingerprint:
+        return None
+    # Mark the entry as recently used so pruning keeps it
+    try:
+        os.utime(cache_file)
+    except OSError:
+        pass
+    return cached['rows']
+
+
+def save_cached_layout(fingerprint, layout, cache_dir=LAYOUT_CACHE_DIR):
+    """Stores a classified layout under its fingerprint. Failures only print a warning."""
+    cache_dir = Path(cache_dir)
+    cache_file = cache_dir / f"{fingerprint}.json"
+    temp_file = None
+    try:
+        cache_dir.mkdir(parents=True, exist_ok=True)
+        # A unique temporary name, so jobs running at the same time never write the same file
+        fd, temp_file = tempfile.mkstemp(dir=cache_dir, prefix=f"{fingerprint[:12]}-", suffix='.tmp')
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump({'version': LAYOUT_FORMAT_VERSION, 'fingerprint': fingerprint, 'rows': layout},
+                      f, separators=(',', ':'))
+        os.replace(temp_file, cache_file)
+        temp_file = None
+        prune_layout_cache(cache_dir)
+    except OSError as e:
+        print(f"  Warning: Could not save recap layout cache to {cache_file}: {e}")
+    finally:
+        if temp_file is not None:
+            Path(temp_file).unlink(missing_ok=True)
+
+
+def prune_layout_cache(cache_dir=LAYOUT_CACHE_DIR, max_entries=LAYOUT_CACHE_MAX_ENTRIES):
+    """Deletes all but the `max_entries` most recently used layouts."""
+    entries = list(Path(cache_dir).glob('*.json'))
+    if len(entries) <= max_entries:
+        return
+    entries.sort(key=lambda p: p.stat().st_mtime, reverse=True)
+    for stale_entry in entries[max_entries:]:
+        stale_entry.unlink(missing_ok=True)
@@ -0,0 +1,255 @@
+import csv
+import posixpath
+import re
+import zipfile
+import xml.etree.ElementTree as ET
+from pathlib import Path
+
+from openpyxl.utils.cell import get_column_letter
+
+from worksheet_readers import get_worksheet_file_type
+
+# Pre-flight validation of the input files, done before any full parse.
+# For .xlsx/.xlsm only xl/workbook.xml, its relationships, the first few rows of the
+# needed sheet XMLs and the shared strings those rows point at are read from the zip.
+
+XLSX_FILE_TYPES = ('.xlsx', '.xlsm')
+WORKBOOK_PART = 'xl/workbook.xml'
+WORKBOOK_RELS_PART = 'xl/_rels/workbook.xml.rels'
+SHARED_STRINGS_PART = 'xl/sharedStrings.xml'
+RELATIONSHIP_ID_ATTR = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+STRICT_RELATIONSHIP_ID_ATTR = '{http://purl.oclc.org/ooxml/officeDocument/relationships}id'
+
+
+class PreflightReport:
+    """Collects every problem found, so they can all be reported at once.
+
+    Errors are problems the allocator would stop on; warnings are problems it
+    would work around by skipping data (e.g. a missing depot sheet).
+    """
+
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    def error(self, message):
+        self.errors.append(message)
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+    def print_report(self):
+        for message in self.errors:
+            print(f"  ERROR: {message}")
+        for message in self.warnings:
+            print(f"  Warning: {message}")
+        if not self.errors and not self.warnings:
+            print("  All pre-flight checks passed.")
+
+
+# --- Minimal XLSX Reading ---
+def _local_name(tag):
+    """Drops the XML namespace, so transitional and strict OOXML files read the same."""
+    return tag.rsplit('}', 1)[-1]
+
+def _column_index(cell_ref):
+    """Returns the 1-based column of a cell reference like 'C6'."""
+    letters = re.match(r'[A-Z]+', cell_ref).group(0)
+    index = 0
+    for letter in letters:
+        index = index * 26 + (ord(letter) - ord('A') + 1)
+    return index
+
+def _text_of(element):
+    """Concatenates the <t> text under a shared string or inline string, skipping phonetic runs."""
+    parts = []
+    for child in element:
+        name = _local_name(child.tag)
+        if name == 't':
+            parts.append(child.text or '')
+        elif name == 'r':
+            parts.append(_text_of(child))
+    return ''.join(parts)
+
+def read_xlsx_sheet_names(archive):
+    """Returns {sheet name: zip part name} from the workbook XML and its relationships."""
+    targets = {}
+    with archive.open(WORKBOOK_RELS_PART) as f:
+        for rel in ET.parse(f).getroot():
+            target = rel.get('Target', '')
+            if target.startswith('/'):
+                part = target.lstrip('/')
+            else:
+                part = posixpath.normpath(posixpath.join('xl', target))
+            targets[rel.get('Id')] = part
+
+    sheets = {}
+    with archive.open(WORKBOOK_PART) as f:
+        for element in ET.parse(f).getroot().iter():
+            if _local_name(element.tag) == 'sheet':
+                rel_id = element.get(RELATIONSHIP_ID_ATTR) or element.get(STRICT_RELATIONSHIP_ID_ATTR)
+                sheets[element.get('name')] = targets.get(rel_id)
+    return sheets
+
+def read_xlsx_top_rows(archive, sheet_part, max_row):
+    """Returns {row: {column: raw value}} for rows 1..max_row, stopping the parse after that.
+
+    Shared string cells hold ('s', index) until resolve_shared_strings() fills them in.
+    """
+    rows = {}
+    row_number = 0
+    column_number = 0
+    with archive.open(sheet_part) as f:
+        for event, element in ET.iterparse(f, events=('start', 'end')):
+            name = _local_name(element.tag)
+            if event == 'start':
+                if name == 'row':
+                    row_number = int(element.get('r', row_number + 1))
+                    column_number = 0
+                    if row_number > max_row:
+                        break
+                continue
+            if name != 'c':
+                if name == 'row':
+                    element.clear()
+                continue
+
+            cell_ref = element.get('r')
+            column_number = _column_index(cell_ref) if cell_ref else column_number + 1
+            cell_type = element.get('t', 'n')
+            value = None
+            if cell_type == 'inlineStr':
+                inline = next((child for child in element if _local_name(child.tag) == 'is'), None)
+                value = _text_of(inline) if inline is not None else ''
+            else:
+                value_element = next((child for child in element if _local_name(child.tag) == 'v'), None)
+                if value_element is not None and value_element.text is not None:
+                    value = ('s', int(value_element.text)) if cell_type == 's' else value_element.text
+            if value is not None:
+                rows.setdefault(row_number, {})[column_number] = value
+    return rows
+
+def resolve_shared_strings(archive, sheet_rows):
+    """Replaces ('s', index) placeholders with text, reading shared strings only up to the highest index used."""
+    needed = {value[1] for rows in sheet_rows.values() for row in rows.values()
+              for value in row.values() if isinstance(value, tuple)}
+    if not needed:
+        return
+    strings = {}
+    if SHARED_STRINGS_PART in archive.namelist():
+        last_needed = max(needed)
+        index = 0
+        with archive.open(SHARED_STRINGS_PART) as f:
+            for event, element in ET.iterparse(f, events=('end',)):
+                if _local_name(element.tag) != 'si':
+                    continue
+                if index in needed:
+                    strings[index] = _text_of(element)
+                element.clear()
+                if index >= last_needed:
+                    break
+                index += 1
+    for rows in sheet_rows.values():
+        for row in rows.values():
+            for column, value in row.items():
+                if isinstance(value, tuple):
+                    row[column] = strings.get(value[1], '')
+
+def read_xlsx_headers(path, sheet_names, max_row):
+    """Returns (all sheet names, {sheet: {row: {column: value}}}) for the requested sheets present in the workbook."""
+    with zipfile.ZipFile(path) as archive:
+        sheet_parts = read_xlsx_sheet_names(archive)
+        sheet_rows = {name: read_xlsx_top_rows(archive, sheet_parts[name], max_row)
+                      for name in sheet_names if sheet_parts.get(name)}
+        resolve_shared_strings(archive, sheet_rows)
+    return list(sheet_parts), sheet_rows
+
+def read_csv_headers(path, max_row):
+    """Same shape as read_xlsx_headers for a per-depot CSV export or a folder of them."""
+    path = Path(path)
+    csv_files = sorted(p for p in path.iterdir() if p.suffix.lower() == '.csv') if path.is_dir() else [path]
+    sheet_rows = {}
+    for csv_file in csv_files:
+        rows = {}
+        with open(csv_file, newline='', encoding='utf-8-sig') as f:
+            for row_number, row in enumerate(csv.reader(f), start=1):
+                if row_number > max_row:
+                    break
+                rows[row_number] = {column: value for column, value in enumerate(row, start=1) if value != ''}
+        sheet_rows[csv_file.stem] = rows
+    return list(sheet_rows), sheet_rows
+
+
+# --- Checks ---
+def _check_header(report_problem, location, header_cells, expected_header, consequence=''):
+    """Reports a missing header through `report_problem`, pointing out near misses such as stray spaces or different case."""
+    if expected_header in header_cells.values():
+        return True
+    near_misses = [str(value) for value in header_cells.values()
+                   if str(value).strip().lower() == expected_header.lower()]
+    if near_misses:
+        report_problem(f"{location}: header '{expected_header}' is misnamed as {near_misses[0]!r}.{consequence}")
+    else:
+        report_problem(f"{location}: header '{expected_header}' not found. "
+                       f"Found: {[str(v) for v in header_cells.values()]}.{consequence}")
+    return False
+
+def validate_worksheet(path, report, depot_sheets, header_row, required_headers):
+    """Checks that the depot sheets exist and carry the required headers on `header_row`."""
+    path = Path(path)
+    if not path.exists():
+        report.error(f"Worksheet file not found: {path}")
+        return
+    file_type = get_worksheet_file_type(path)
+    try:
+        if file_type in XLSX_FILE_TYPES:
+            available_sheets, sheet_rows = read_xlsx_headers(path, depot_sheets, header_row)
+        elif file_type == '.csv':
+            available_sheets, sheet_rows = read_csv_headers(path, header_row)
+        else:
+            report.warning(f"Pre-flight checks are not available for '{file_type}' worksheets; skipped.")
+            return
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, OSError, UnicodeDecodeError) as e:
+        report.error(f"Worksheet {path.name} could not be read as a {file_type} file: {e}")
+        return
+
+    present_sheets = [s for s in depot_sheets if s in available_sheets]
+    if not present_sheets:
+        report.error(f"None of the configured depot sheets {depot_sheets} were found in {path.name}. "
+                     f"Sheets found: {available_sheets}")
+        return
+    for sheet_name in depot_sheets:
+        if sheet_name not in available_sheets:
+            report.warning(f"Depot sheet '{sheet_name}' not found in {path.name}; it will be skipped.")
+
+    for sheet_name in present_sheets:
+        header_cells = sheet_rows.get(sheet_name, {}).get(header_row, {})
+        for expected_header in required_headers:
+            # The allocator skips such a sheet rather than stopping
+            _check_header(report.warning, f"Sheet '{sheet_name}' row {header_row}", header_cells, expected_header,
+                          consequence=" The sheet will be skipped.")
+
+def validate_recap(path, report, sheet_name, header_row, amount_header, amount_column):
+    """Checks that the recap sheet exists and has the amount header on `header_row`, in column number `amount_column`."""
+    path = Path(path)
+    if not path.exists():
+        report.error(f"Recap file not found: {path}")
+        return
+    if path.suffix.lower() not in XLSX_FILE_TYPES:
+        report.error(f"Recap file {path.name} must be an .xlsx or .xlsm workbook.")
+        return
+    try:
+        available_sheets, sheet_rows = read_xlsx_headers(path, [sheet_name], header_row)
+    except (zipfile.BadZipFile, KeyError, ET.ParseError, OSError) as e:
+        report.error(f"Recap {path.name} could not be read as an Excel workbook: {e}")
+        return
+
+    if sheet_name not in available_sheets:
+        report.error(f"Sheet '{sheet_name}' not found in {path.name}. Sheets found: {available_sheets}")
+        return
+    header_cells = sheet_rows[sheet_name].get(header_row, {})
+    location = f"Recap sheet '{sheet_name}' row {header_row}"
+    if _check_header(report.error, location, header_cells, amount_header) and header_cells.get(amount_column) != amount_header:
+        column_letter = get_column_letter(amount_column)
+        report.warning(f"{location}: '{amount_header}' is not in column {column_letter}, "
+                       f"but amounts are always written to column {column_letter}.")
@@ -0,0 +1,190 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+# --- Journal Configuration ---
+# Each recap gets its own folder of run entries, one gzipped JSON file per run
+JOURNAL_DIR = Path.home() / '.scrap_allocator' / 'journal'
+JOURNAL_FORMAT_VERSION = 1
+JOURNAL_MAX_RUNS = 50
+JOURNAL_MAX_AGE_DAYS = 90
+JOURNAL_VALUE_COLUMN = 3 # Column C
+
+
+def file_fingerprint(path):
+    """Returns the SHA-256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def journal_dir_for(recap_path, journal_root=JOURNAL_DIR):
+    """Returns the journal folder of one recap file, keyed by its resolved path."""
+    recap_path = Path(recap_path)
+    path_key = os.path.normcase(os.path.realpath(recap_path))
+    path_hash = hashlib.sha1(path_key.encode('utf-8')).hexdigest()[:12]
+    return Path(journal_root) / f"{recap_path.stem}-{path_hash}"
+
+
+# --- Cell Value Encoding ---
+# Cell values are stored as JSON; dates and times are tagged so they come back as the same type.
+def _encode_value(value):
+    if isinstance(value, datetime.datetime):
+        return {'datetime': value.isoformat()}
+    if isinstance(value, datetime.date):
+        return {'date': value.isoformat()}
+    if isinstance(value, datetime.time):
+        return {'time': value.isoformat()}
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+def _decode_value(value):
+    if isinstance(value, dict):
+        if 'datetime' in value:
+            return datetime.datetime.fromisoformat(value['datetime'])
+        if 'date' in value:
+            return datetime.date.fromisoformat(value['date'])
+        if 'time' in value:
+            return datetime.time.fromisoformat(value['time'])
+    return value
+
+
+# --- Journal Entries ---
+def record_run(recap_path, sheet_name, changes, fingerprint_before, fingerprint_after,
+               journal_root=JOURNAL_DIR, kind='allocation', details=None):
+    """Stores the column C cells a run changed as a compressed journal entry. Returns the run id.
+
+    `changes` is a list of (excel_row, old_value, new_value).
+    """
+    now = datetime.datetime.now()
+    run_id = now.strftime('%Y%m%d-%H%M%S-%f') # Sorts in run order
+    entry = {
+        'version': JOURNAL_FORMAT_VERSION,
+        'run_id': run_id,
+        'kind': kind,
+        'created': now.isoformat(timespec='seconds'),
+        'recap_file': str(Path(recap_path).resolve()),
+        'sheet': sheet_name,
+        'column': JOURNAL_VALUE_COLUMN,
+        'fingerprint_before': fingerprint_before,
+        'fingerprint_after': fingerprint_after,
+        'details': details or {},
+        'changes': [[row, _encode_value(old), _encode_value(new)] for row, old, new in changes],
+    }
+    journal_dir = journal_dir_for(recap_path, journal_root)
+    journal_dir.mkdir(parents=True, exist_ok=True)
+    with gzip.open(journal_dir / f"{run_id}.json.gz", 'wt', encoding='utf-8') as f:
+        json.dump(entry, f, separators=(',', ':'))
+    return run_id
+
+def list_runs(recap_path, journal_root=JOURNAL_DIR):
+    """Returns the journal entries of a recap, oldest first."""
+    journal_dir = journal_dir_for(recap_path, journal_root)
+    if not journal_dir.is_dir():
+        return []
+    entries = []
+    for entry_file in sorted(journal_dir.glob('*.json.gz')):
+        try:
+            with gzip.open(entry_file, 'rt', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"  Warning: Ignoring unreadable journal entry {entry_file}: {e}")
+            continue
+        if entry.get('version') == JOURNAL_FORMAT_VERSION:
+            entries.append(entry)
+    return entries
+
+def prune_journal(recap_path, journal_root=JOURNAL_DIR, max_runs=JOURNAL_MAX_RUNS, max_age_days=JOURNAL_MAX_AGE_DAYS):
+    """Deletes entries beyond the newest `max_runs` or older than `max_age_days`. Returns how many were removed."""
+    journal_dir = journal_dir_for(recap_path, journal_root)
+    if not journal_dir.is_dir():
+        return 0
+    entry_files = sorted(journal_dir.glob('*.json.gz'), reverse=True) # Newest first
+    cutoff = datetime.datetime.now() - datetime.timedelta(days=max_age_days)
+    removed = 0
+    position = 0
+    for entry_file in entry_files:
+        try:
+            created = datetime.datetime.strptime(entry_file.name.split('.')[0], '%Y%m%d-%H%M%S-%f')
+        except ValueError:
+            continue # Not a run entry (e.g. a renamed copy); leave it alone
+        if position >= max_runs or created < cutoff:
+            entry_file.unlink(missing_ok=True)
+            removed += 1
+        position += 1
+    return removed
+
+
+# --- Saving ---
+def save_workbook_atomically(wb, recap_path):
+    """Saves the workbook to a temporary file next to the recap, then swaps it in.
+
+    If the process is stopped part-way (e.g. a job cancelled from the GUI) the
+    recap keeps its previous contents instead of being left half written.
+    """
+    recap_path = Path(recap_path)
+    fd, temp_path = tempfile.mkstemp(dir=recap_path.parent, prefix=f".{recap_path.stem}-", suffix=recap_path.suffix)
+    os.close(fd)
+    try:
+        wb.save(temp_path)
+        if recap_path.exists():
+            shutil.copymode(recap_path, temp_path)
+        os.replace(temp_path, recap_path)
+    except BaseException:
+        Path(temp_path).unlink(missing_ok=True)
+        raise
+
+
+# --- Rollback ---
+def rollback_recap(recap_path, run_id=None, journal_root=JOURNAL_DIR, force=False):
+    """Restores the recap to how it was before `run_id` (default: the latest run).
+
+    That run and every later one are undone newest first, patching only the
+    cells they changed. The rollback is itself recorded, so it can be undone
+    the same way. Raises ValueError if there is nothing to roll back, the run is
+    unknown, or the file changed since the latest recorded run (unless `force`).
+    Returns (rollback run id, undone run ids, number of cells restored).
+    """
+    entries = list_runs(recap_path, journal_root)
+    if not entries:
+        raise ValueError(f"No journal entries found for {recap_path}.")
+    if run_id is None:
+        start = len(entries) - 1
+    else:
+        run_ids = [entry['run_id'] for entry in entries]
+        if run_id not in run_ids:
+            raise ValueError(f"Run '{run_id}' not found in the journal of {recap_path}.")
+        start = run_ids.index(run_id)
+    to_undo = list(reversed(entries[start:]))
+
+    fingerprint_before = file_fingerprint(recap_path)
+    if fingerprint_before != to_undo[0]['fingerprint_after'] and not force:
+        raise ValueError(f"{recap_path} has changed since run {to_undo[0]['run_id']} was recorded. "
+                         "Use --force to roll back anyway.")
+
+    sheet_name = to_undo[0]['sheet']
+    wb = load_workbook(recap_path, data_only=False)
+    ws = wb[sheet_name]
+    values_before = {} # Excel row -> value before this rollback
+    for entry in to_undo:
+        for row, old_value, _ in entry['changes']:
+            target_cell = ws.cell(row=row, column=entry['column'])
+            values_before.setdefault(row, target_cell.value)
+            target_cell.value = _decode_value(old_value)
+    save_workbook_atomically(wb, recap_path)
+
+    changes = [(row, old_value, ws.cell(row=row, column=JOURNAL_VALUE_COLUMN).value)
+               for row, old_value in values_before.items()]
+    undone_ids = [entry['run_id'] for entry in to_undo]
+    rollback_id = record_run(recap_path, sheet_name, changes, fingerprint_before, file_fingerprint(recap_path),
+                             journal_root, kind='rollback', details={'undone_runs': undone_ids})
+    return rollback_id, undone_ids, len(changes)
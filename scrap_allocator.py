@@ -1,10 +1,20 @@
 import pandas as pd
 import re
 import sys
+import time
 import traceback
 from openpyxl import load_workbook
 from openpyxl.utils.cell import get_column_letter
 import argparse
+import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from worksheet_readers import open_worksheet_reader, READER_ENGINE_CHOICES
+from preflight import PreflightReport, validate_worksheet, validate_recap
+from recap_journal import (JOURNAL_DIR, JOURNAL_MAX_RUNS, JOURNAL_MAX_AGE_DAYS, file_fingerprint,
+                           record_run, list_runs, prune_journal, rollback_recap, save_workbook_atomically)
+from layout_cache import LAYOUT_CACHE_DIR, layout_fingerprint, load_cached_layout, save_cached_layout
 
 print("--- Script Starting ---")
 
@@ -168,39 +178,15 @@ def find_depot_numbers_in_recap_row(text):
     # This will match both individual depots (D401) and sections (D401/D404/D410)
     return re.findall(r'D(\d+)(?!\d)', text)
 
-# --- Main Logic ---
-def main():
-    print("--- Script Starting ---")
-
-    # --- Argument Parsing ---
-    parser = argparse.ArgumentParser(description='Process scrap allocation files.')
-    parser.add_argument('worksheet_file', help='Path to the input Sales Worksheet Excel file.')
-    parser.add_argument('recap_file', help='Path to the input/output Recap Allocation Excel file.')
-    args = parser.parse_args()
-    print(f"Using Worksheet File: {args.worksheet_file}")
-    print(f"Using Recap File: {args.recap_file}")
-    # --- End Argument Parsing ---
+def aggregate_worksheet(reader, sheets_to_process):
+    """Sums worksheet tons per (depot, mill, alias) and per depot across the given depot sheets.
 
-    # 1. Read Worksheet Data and Aggregate Amounts
+    Returns (aggregated_amounts, depot_grand_totals, depots_read), where
+    depots_read lists the depots whose sheet was read with valid headers.
+    """
     aggregated_amounts = {}
-    depot_grand_totals = {} # New dictionary to store total per depot
-    print(f"Reading worksheet file: {args.worksheet_file}")
-    # Read sheet names first to know which ones exist
-    try:
-        xls = pd.ExcelFile(args.worksheet_file, engine='openpyxl')
-        available_sheets = xls.sheet_names
-    except FileNotFoundError:
-        print(f"ERROR: Worksheet file not found: {args.worksheet_file}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"ERROR: Could not probe worksheet file sheets: {e}")
-        sys.exit(1)
-
-    sheets_to_process = [s for s in WORKSHEET_DEPOT_SHEETS if s in available_sheets]
-    if not sheets_to_process:
-        print(f"ERROR: None of the configured depot sheets {WORKSHEET_DEPOT_SHEETS} were found in {args.worksheet_file}")
-        sys.exit(1)
-
+    depot_grand_totals = {} # Total per depot
+    depots_read = []
     for sheet_name in sheets_to_process:
         depot_num = get_depot_number(sheet_name)
         if not depot_num:
@@ -214,7 +200,7 @@ def main():
 
         try:
             # Read individual sheet with specific header row (index 2)
-            df_sheet = pd.read_excel(args.worksheet_file, sheet_name=sheet_name, engine='openpyxl', header=header_index)
+            df_sheet = reader.read_sheet(sheet_name, header=header_index)
         except Exception as e:
             print(f"  ERROR: Could not read sheet '{sheet_name}'. Error: {e}. Skipping sheet.")
             continue
@@ -226,6 +212,7 @@ def main():
         if WORKSHEET_TONS_COL not in df_sheet.columns:
             print(f"  ERROR: Amount column '{WORKSHEET_TONS_COL}' not found in sheet '{sheet_name}'. Skipping sheet.")
             continue
+        depots_read.append(depot_num)
 
         for index, row in df_sheet.iterrows():
             # Access columns by header name for reliability
@@ -254,82 +241,189 @@ def main():
                 # Also add to the depot grand total
                 depot_grand_totals[depot_num] = depot_grand_totals.get(depot_num, 0) + tons
 
-    print(f"\nFinished reading worksheet. Aggregated {len(aggregated_amounts)} entries.")
-    # Optional: Print depot grand totals for debugging
-    # print("\n--- Depot Grand Totals ---")
-    # for depot, total in depot_grand_totals.items():
-    #     print(f"  Depot {depot}: {total}")
-    # print("--------------------------\n")
-
-    # 2. Read Recap Sheet (using fixed header row 6)
-    print(f"\nReading recap file: {args.recap_file}, sheet: {RECAP_SHEET_NAME}")
-    try:
-        # Read using header=5 (Row 6)
-        df_recap = pd.read_excel(args.recap_file, sheet_name=RECAP_SHEET_NAME, engine='openpyxl', header=5, keep_default_na=False)
-
-        # Check if needed columns were found using the names from Row 6
-        if RECAP_AMOUNT_COL not in df_recap.columns:
-            print(f"ERROR: Target amount column '{RECAP_AMOUNT_COL}' (expected C6) not found in header row 6 of sheet '{RECAP_SHEET_NAME}'. Found headers: {list(df_recap.columns)}")
-            sys.exit(1)
-
-        # Rename the first column (Column A, likely unnamed or misnamed due to blank A6) to 'Structure'
-        first_col_name = df_recap.columns[0]
-        print(f"  Renaming first column (originally '{first_col_name}') to '{RECAP_STRUCTURE_COL}' for internal use.")
-        df_recap.rename(columns={first_col_name: RECAP_STRUCTURE_COL}, inplace=True)
-
-        # Now check if the renamed structure column exists
-        if RECAP_STRUCTURE_COL not in df_recap.columns:
-             print(f"ERROR: Failed to access structure column after renaming. Columns: {list(df_recap.columns)}")
-             sys.exit(1)
-
-        # Ensure the target amount column is numeric for calculations
-        df_recap[RECAP_AMOUNT_COL] = pd.to_numeric(df_recap[RECAP_AMOUNT_COL], errors='coerce').fillna(0)
-
-        # Create a copy for modification
-        df_recap_modified = df_recap.copy()
-        # IMPORTANT: Clear the target column before populating
-        df_recap_modified[RECAP_AMOUNT_COL] = 0.0
+    return aggregated_amounts, depot_grand_totals, depots_read
+
+def aggregate_worksheet_file(worksheet_file, reader_engine='auto'):
+    """Reads one worksheet input into a partial aggregate for merge_worksheet_partials().
+
+    Runs in a worker process when several worksheets are given, so it only
+    takes and returns plain picklable values. Raises ValueError if none of the
+    configured depot sheets are in the file.
+    """
+    with open_worksheet_reader(worksheet_file, engine=reader_engine) as reader:
+        print(f"  Reading {worksheet_file} with the '{reader.engine}' reader engine.")
+        available_sheets = reader.sheet_names()
+        sheets_to_process = [s for s in WORKSHEET_DEPOT_SHEETS if s in available_sheets]
+        if not sheets_to_process:
+            raise ValueError(f"None of the configured depot sheets {WORKSHEET_DEPOT_SHEETS} were found in {worksheet_file}")
+        aggregated_amounts, depot_grand_totals, depots_read = aggregate_worksheet(reader, sheets_to_process)
+    return {
+        'file': str(worksheet_file),
+        'aggregated': aggregated_amounts,
+        'grand_totals': depot_grand_totals,
+        'depots': depots_read,
+    }
 
-    except FileNotFoundError:
-        print(f"ERROR: Recap file not found: {args.recap_file}")
-        sys.exit(1)
-    except ValueError as e: # Handles sheet not found
-        print(f"ERROR: Sheet '{RECAP_SHEET_NAME}' not found in {args.recap_file}. Details: {e}")
-        sys.exit(1)
-    except Exception as e:
-        print(f"ERROR: Could not read recap file: {e}")
-        sys.exit(1)
+def merge_worksheet_partials(partials):
+    """Merges per-file partial aggregates, in the order given, into one allocation.
 
-    # 3. Process Recap Sheet Rows to Update Amounts
-    rows_updated = 0
+    Partials are added together, except that a partial marked 'override'
+    replaces everything earlier partials contributed for each depot it read.
+    Merging is done one partial at a time so results can be consumed as they
+    arrive. Returns (aggregated_amounts, depot_grand_totals, provenance), where
+    provenance maps each (depot, mill, alias) key to its [file, tons, status]
+    contributions; status is 'added', 'override' or 'replaced'.
+    """
+    aggregated_amounts = {}
+    depot_grand_totals = {}
+    provenance = {}
+
+    for partial in partials:
+        is_override = partial.get('override', False)
+        if is_override:
+            for depot_num in partial['depots']:
+                for key in [key for key in aggregated_amounts if key[0] == depot_num]:
+                    del aggregated_amounts[key]
+                depot_grand_totals.pop(depot_num, None)
+                for key, contributions in provenance.items():
+                    if key[0] == depot_num:
+                        for contribution in contributions:
+                            contribution[2] = 'replaced'
+
+        for key, tons in partial['aggregated'].items():
+            aggregated_amounts[key] = aggregated_amounts.get(key, 0) + tons
+            provenance.setdefault(key, []).append([partial['file'], tons, 'override' if is_override else 'added'])
+        for depot_num, tons in partial['grand_totals'].items():
+            depot_grand_totals[depot_num] = depot_grand_totals.get(depot_num, 0) + tons
+
+    return aggregated_amounts, depot_grand_totals, provenance
+
+def print_provenance_report(provenance, aggregated_amounts):
+    """Prints which worksheet file contributed which tons to every aggregated key."""
+    print("\n--- Worksheet Provenance ---")
+    for key in sorted(provenance):
+        depot_num, mill_name, alias = key
+        print(f"  Depot {depot_num} | {mill_name} | {alias}: {aggregated_amounts.get(key, 0)}")
+        for worksheet_file, tons, status in provenance[key]:
+            print(f"      {status:<9} {tons:>12}  {worksheet_file}")
+    print("----------------------------")
+
+def write_provenance_csv(provenance, aggregated_amounts, csv_path):
+    """Writes the provenance report as one CSV row per file contribution."""
+    with open(csv_path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['Depot', 'Mill', 'Alias', 'Worksheet File', 'Tons', 'Status', 'Merged Tons'])
+        for key in sorted(provenance):
+            for worksheet_file, tons, status in provenance[key]:
+                writer.writerow([*key, worksheet_file, tons, status, aggregated_amounts.get(key, 0)])
+
+def get_recap_structure_texts(df_recap):
+    """Returns the stripped column A text of every recap row ('' for blanks)."""
+    return [str(value).strip() if pd.notna(value) else '' for value in df_recap[RECAP_STRUCTURE_COL]]
+
+def get_recap_formula_rows(ws, row_count):
+    """Returns the indexes of recap rows whose column C holds a formula."""
+    # Add 7 because Excel is 1-indexed and we have a header row at row 6
+    return [index for index in range(row_count) if ws.cell(row=index + 7, column=3).data_type == 'f']
+
+def read_recap_frame(recap_file):
+    """Reads the recap sheet with pandas (header row 6), naming column A RECAP_STRUCTURE_COL."""
+    df_recap = pd.read_excel(recap_file, sheet_name=RECAP_SHEET_NAME, engine='openpyxl', header=5, keep_default_na=False)
+    # Column A is likely unnamed or misnamed due to blank A6
+    df_recap.rename(columns={df_recap.columns[0]: RECAP_STRUCTURE_COL}, inplace=True)
+    return df_recap
+
+def get_recap_rows_from_sheet(ws):
+    """Returns (structure_texts, formula_rows) straight from the loaded recap sheet.
+
+    Gives the same rows and text as get_recap_structure_texts() and
+    get_recap_formula_rows() do for the pandas read of the sheet, so the recap
+    only has to be parsed once: rows run from row 7 to the last row holding a
+    value, and whole-number floats read as ints. Returns None when the result
+    could differ. Pandas sees the cached results of formulas where this
+    workbook holds the formulas, which matters for formulas in column A or the
+    header row, and for formula-only rows after the last value.
+    """
+    if any(cell.data_type == 'f' for cell in ws[6]):
+        return None
+    structure_texts = []
+    formula_rows = []
+    last_value_index = -1 # Last row with a value that is not a formula
+    trailing_formula_rows = [] # (index, formula in column C) of formula-only rows after it
+    for index, row in enumerate(ws.iter_rows(min_row=7)):
+        has_value = False
+        has_formula = False
+        for cell in row:
+            if cell.value is None or cell.value == '':
+                continue
+            if cell.data_type != 'f':
+                has_value = True
+                continue
+            if cell.column == 1:
+                return None
+            has_formula = True
+            if cell.column == 3:
+                formula_rows.append(index)
+        if has_value:
+            last_value_index = index
+            trailing_formula_rows = []
+        elif has_formula:
+            trailing_formula_rows.append((index, formula_rows[-1:] == [index]))
+
+        text_cell = row[0]
+        if text_cell.value is None or text_cell.data_type == 'e':
+            structure_texts.append('')
+        else:
+            value = text_cell.value
+            if isinstance(value, float) and value.is_integer():
+                value = int(value)
+            structure_texts.append(str(value).strip())
+
+    row_count = last_value_index + 1
+    # Whether pandas keeps formula-only rows depends on their cached results. A run of
+    # them right after the last value, each with a formula in column C, gives the
+    # same recap either way, since formula rows are never written.
+    for offset, (index, in_column_c) in enumerate(trailing_formula_rows):
+        if index != row_count + offset or not in_column_c:
+            return None
+    row_count += len(trailing_formula_rows)
+    return structure_texts[:row_count], [index for index in formula_rows if index < row_count]
+
+def classify_recap_rows(structure_texts, formula_rows):
+    """Works out the role of every recap row from its column A text.
+
+    Returns one dict per row (index 0 is Excel row 7). A row can carry:
+      'role':    'mill', 'depot', 'alias', 'total' or 'grand_total'
+      'mill', 'depots', 'alias': the lookup key parts of an alias row
+      'total':   'mill' or 'depot' for a Total row
+      'depot':   the depot number of a 'Total GT Dxxx' row
+      'formula': True if the row's column C holds a formula
+    Rows with no role are left at 0.
+    """
+    known_mills = set(info['mill'] for depot_map in mapping.values() for info in depot_map.values())
+    known_aliases = set(info['alias'] for depot_map in mapping.values() for info in depot_map.values())
+    sorted_known_aliases = sorted(list(known_aliases), key=len, reverse=True)
+    formula_rows = set(formula_rows)
+
+    layout = []
     current_mill = None
     current_depot_header_text = None
-    current_depot_sum = 0
-    current_mill_sum = 0
-    rows_to_update_with_totals = {}
-    rows_to_update_with_grand_totals = {} # New: Store index for Depot Grand Total rows
 
-    print("\nProcessing recap sheet and populating amounts...")
-    # First pass: Identify rows, update aliases, and track sums/total row locations
-    for index, row in df_recap.iterrows():
-        structure_text = str(row[RECAP_STRUCTURE_COL]).strip() if pd.notna(row[RECAP_STRUCTURE_COL]) else ''
+    for index, structure_text in enumerate(structure_texts):
+        row_layout = {'formula': True} if index in formula_rows else {}
+        layout.append(row_layout)
 
         # --- Refined Row Type Identification ---
         is_mill_row = False
         is_depot_header_row = False
         is_alias_row = False
         is_total_row = False
-        is_grand_total_row = False # New flag
+        is_grand_total_row = False
         total_row_type = None
 
-        known_mills = set(info['mill'] for depot_map in mapping.values() for info in depot_map.values())
-        known_aliases = set(info['alias'] for depot_map in mapping.values() for info in depot_map.values())
-
         # --- Hardcoded Skip for Specific Unmapped Mills ---
         if structure_text in ['CMC - LCMC606', 'East Jordan - LEJO601']:
-            # print(f"DEBUG: Hardcoded skip - Resetting mill context for: '{structure_text}'")
             current_mill = None # Ensure subsequent lookups fail
-            # Potentially clear sums if needed, but likely handled by 0 lookup
             continue # Skip further processing for this specific header row
         # --- End Hardcoded Skip ---
 
@@ -363,8 +457,7 @@ def main():
         if is_mill_row:
             current_mill = structure_text
             current_depot_header_text = None
-            current_depot_sum = 0
-            current_mill_sum = 0
+            row_layout['role'] = 'mill'
             continue
 
         if not current_mill and not is_grand_total_row: # Allow Grand Totals even without mill context
@@ -372,30 +465,27 @@ def main():
 
         if is_depot_header_row:
             current_depot_header_text = structure_text
-            current_depot_sum = 0
+            row_layout['role'] = 'depot'
             continue
 
         if is_grand_total_row:
-            # Store index and the depot number it applies to
-            rows_to_update_with_grand_totals[index] = grand_total_depot
+            row_layout.update(role='grand_total', depot=grand_total_depot)
             continue
 
         if is_total_row:
-             sum_to_store = current_mill_sum if total_row_type == 'mill' else current_depot_sum
-             rows_to_update_with_totals[index] = {'type': total_row_type, 'value': sum_to_store}
-             continue
+            row_layout.update(role='total', total=total_row_type)
+            continue
 
         # Process as Grade Alias row
         if is_alias_row and current_depot_header_text:
             recap_alias_raw = structure_text
             depots_for_this_row = find_depot_numbers_in_recap_row(current_depot_header_text)
 
-            # --- Alias Extraction Logic (keep) ---
+            # --- Alias Extraction Logic ---
             if recap_alias_raw in known_aliases:
                 recap_alias_lookup = recap_alias_raw
             else:
                 base_alias_found = None
-                sorted_known_aliases = sorted(list(known_aliases), key=len, reverse=True)
                 for known_alias in sorted_known_aliases:
                     if recap_alias_raw.startswith(known_alias) and \
                        (len(recap_alias_raw) == len(known_alias) or recap_alias_raw[len(known_alias)] in [' ', '-']):
@@ -407,104 +497,253 @@ def main():
             if not depots_for_this_row or not recap_alias_lookup:
                 continue
 
+            row_layout.update(role='alias', mill=current_mill, depots=depots_for_this_row, alias=recap_alias_lookup)
+
+    return layout
+
+def fill_recap_amounts(layout, aggregated_amounts, depot_grand_totals):
+    """Computes the column C value of every recap row from a classified layout.
+
+    Alias rows get the summed tons of their depots, Total rows the running
+    depot or mill sum at that point, and 'Total GT' rows the depot grand total.
+    Returns (amounts, rows_updated).
+    """
+    amounts = [0.0] * len(layout)
+    rows_updated = 0
+    current_depot_sum = 0
+    current_mill_sum = 0
+
+    for index, row_layout in enumerate(layout):
+        role = row_layout.get('role')
+        if role == 'mill':
+            current_depot_sum = 0
+            current_mill_sum = 0
+        elif role == 'depot':
+            current_depot_sum = 0
+        elif role == 'alias':
             total_amount_for_row = 0
             found_match_for_row = False
-            for depot_num in depots_for_this_row:
-                key = (depot_num, current_mill, recap_alias_lookup)
+            for depot_num in row_layout['depots']:
+                key = (depot_num, row_layout['mill'], row_layout['alias'])
                 amount = aggregated_amounts.get(key, 0)
                 if amount != 0:
                     total_amount_for_row += amount
                     found_match_for_row = True
-
             if found_match_for_row:
-                # -- REMOVE DEBUG: Print context JUST BEFORE writing --
-                # print(f"DEBUG: Writing Alias - Row: {index + 7}, Structure: '{structure_text}', MillContext: '{current_mill}', DepotHeader: '{current_depot_header_text}', AliasLookup: '{recap_alias_lookup}', Amount: {total_amount_for_row}")
-                # -- END REMOVE --
-                if RECAP_AMOUNT_COL in df_recap_modified.columns:
-                    if pd.api.types.is_number(total_amount_for_row):
-                        df_recap_modified.loc[index, RECAP_AMOUNT_COL] = total_amount_for_row
-                        current_depot_sum += total_amount_for_row
-                        current_mill_sum += total_amount_for_row
-                        rows_updated += 1
-                else:
-                    print(f"    -> ERROR: Target amount column '{RECAP_AMOUNT_COL}' not found.")
-            else:
-                 pass
-
-        elif is_alias_row and not current_depot_header_text:
-             pass
-
-    # --- Second Pass: Update the identified Total Rows ---
-    print("\nUpdating Mill/Depot Total Rows...")
-    for index, total_info in rows_to_update_with_totals.items():
-        total_value = total_info['value']
-        total_type = total_info['type']
-        if pd.api.types.is_number(total_value):
-             if RECAP_AMOUNT_COL in df_recap_modified.columns:
-                 df_recap_modified.loc[index, RECAP_AMOUNT_COL] = total_value
-                 rows_updated += 1
-             else:
-                  print(f"  -> ERROR: Cannot update {total_type.upper()} Total Row {index+7}. Target column '{RECAP_AMOUNT_COL}' not found.")
-        else:
-            print(f"  -> WARNING: Skipping {total_type.upper()} Total Row {index+7}. Calculated sum '{total_value}' is not numeric.")
-
-    # --- Third Pass: Update the Depot Grand Total Rows ---
-    print("\nUpdating Depot Grand Total Rows...")
-    for index, depot_num in rows_to_update_with_grand_totals.items():
-        grand_total_value = depot_grand_totals.get(depot_num, 0) # Get the pre-calculated total
-        if pd.api.types.is_number(grand_total_value):
-             if RECAP_AMOUNT_COL in df_recap_modified.columns:
-                 df_recap_modified.loc[index, RECAP_AMOUNT_COL] = grand_total_value
-                 rows_updated += 1
-             else:
-                  print(f"  -> ERROR: Cannot update Grand Total Row {index+7} for Depot {depot_num}. Target column '{RECAP_AMOUNT_COL}' not found.")
-        else:
-             print(f"  -> WARNING: Skipping Grand Total Row {index+7} for Depot {depot_num}. Calculated sum '{grand_total_value}' is not numeric.")
-    # --- End Updates ---
+                amounts[index] = float(total_amount_for_row)
+                current_depot_sum += total_amount_for_row
+                current_mill_sum += total_amount_for_row
+                rows_updated += 1
+        elif role == 'total':
+            amounts[index] = float(current_mill_sum if row_layout['total'] == 'mill' else current_depot_sum)
+            rows_updated += 1
+        elif role == 'grand_total':
+            amounts[index] = float(depot_grand_totals.get(row_layout['depot'], 0))
+            rows_updated += 1
+
+    return amounts, rows_updated
 
-    print(f"\nFinished processing recap sheet. Updated {rows_updated} rows (including totals).")
+# --- Main Logic ---
+def main():
+    print("--- Script Starting ---")
 
-    # 4. Save Updated Recap File
-    print(f"Saving updated data back to {args.recap_file}, sheet: {RECAP_SHEET_NAME}...")
+    if len(sys.argv) > 1 and sys.argv[1] == 'rollback':
+        rollback_main(sys.argv[2:])
+        return
+
+    # --- Argument Parsing ---
+    parser = argparse.ArgumentParser(description='Process scrap allocation files. '
+                                     'Use "rollback RECAP_FILE [RUN_ID]" to undo earlier runs.')
+    parser.add_argument('worksheet_files', nargs='+', metavar='worksheet_file',
+                        help='Path to the input Sales Worksheet file. Give several to merge them into one allocation.')
+    parser.add_argument('recap_file', help='Path to the input/output Recap Allocation Excel file.')
+    parser.add_argument('--reader', choices=READER_ENGINE_CHOICES, default='auto',
+                        help="Engine for reading the worksheet (default: fastest installed). "
+                             "The worksheet can be .xlsx, .xlsb, a per-depot .csv export or a folder of them.")
+    parser.add_argument('--override', action='append', default=[], metavar='WORKSHEET_FILE',
+                        help='Worksheet whose depot sheets replace, rather than add to, the other worksheets. '
+                             'Applied after them, in the order given. Can be repeated.')
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1,
+                        help='Worksheets to parse at the same time when several are given (default: CPU count).')
+    parser.add_argument('--provenance-csv', metavar='CSV_FILE',
+                        help='Write which worksheet contributed which tons to this CSV file.')
+    parser.add_argument('--no-layout-cache', dest='use_layout_cache', action='store_false',
+                        help='Always re-classify the recap rows instead of reusing a cached layout.')
+    parser.add_argument('--layout-cache-dir', default=LAYOUT_CACHE_DIR,
+                        help=f'Folder for cached recap layouts (default: {LAYOUT_CACHE_DIR}).')
+    parser.add_argument('--no-journal', dest='use_journal', action='store_false',
+                        help='Do not record the changed cells in the recap journal (the run cannot be rolled back).')
+    parser.add_argument('--journal-dir', default=JOURNAL_DIR, help=f'Folder of run journals (default: {JOURNAL_DIR}).')
+    parser.add_argument('--journal-keep-runs', type=int, default=JOURNAL_MAX_RUNS,
+                        help=f'Runs to keep in the journal per recap (default: {JOURNAL_MAX_RUNS}).')
+    parser.add_argument('--journal-max-age-days', type=int, default=JOURNAL_MAX_AGE_DAYS,
+                        help=f'Drop journal entries older than this (default: {JOURNAL_MAX_AGE_DAYS}).')
+    parser.add_argument('--skip-preflight', action='store_true',
+                        help='Skip the quick header and sheet checks that run before the files are parsed.')
+    parser.add_argument('--preflight-only', action='store_true',
+                        help='Only run the pre-flight checks, then exit without changing the recap.')
+    args = parser.parse_args()
+    worksheet_inputs = [(path, False) for path in args.worksheet_files] + [(path, True) for path in args.override]
+    for worksheet_file, is_override in worksheet_inputs:
+        print(f"Using Worksheet File: {worksheet_file}{' (override)' if is_override else ''}")
+    print(f"Using Recap File: {args.recap_file}")
+    # --- End Argument Parsing ---
+
+    # 0. Pre-flight Checks (sheet names and header rows only, before any full parse)
+    if not args.skip_preflight or args.preflight_only:
+        print("\nRunning pre-flight checks...")
+        preflight_start = time.perf_counter()
+        report = PreflightReport()
+        for worksheet_file, _ in worksheet_inputs:
+            validate_worksheet(worksheet_file, report, WORKSHEET_DEPOT_SHEETS,
+                               header_row=3, required_headers=[WORKSHEET_GRADE_COL, WORKSHEET_TONS_COL])
+        validate_recap(args.recap_file, report, RECAP_SHEET_NAME,
+                       header_row=6, amount_header=RECAP_AMOUNT_COL, amount_column=3)
+        report.print_report()
+        print(f"  Pre-flight checks took {(time.perf_counter() - preflight_start) * 1000:.0f} ms.")
+        if report.errors:
+            print(f"ERROR: Pre-flight checks found {len(report.errors)} problem(s). Fix them and run again.")
+            sys.exit(1)
+        if args.preflight_only:
+            print("\nScript finished.")
+            return
+
+    # 1. Read Worksheet Data and Aggregate Amounts
+    # Each worksheet is parsed into a partial aggregate (in parallel when there are
+    # several); partials are merged in input order as they come in.
+    worksheet_files = [worksheet_file for worksheet_file, _ in worksheet_inputs]
+    print(f"Reading {len(worksheet_files)} worksheet input(s)...")
+    worker_count = max(1, min(args.jobs, len(worksheet_files)))
+    executor = ProcessPoolExecutor(max_workers=worker_count) if worker_count > 1 else None
+    partial_results = (executor.map(aggregate_worksheet_file, worksheet_files, repeat(args.reader)) if executor
+                       else map(aggregate_worksheet_file, worksheet_files, repeat(args.reader)))
+
+    current_file = None # Named in error messages
+    def ordered_partials():
+        nonlocal current_file
+        results = iter(partial_results)
+        for worksheet_file, is_override in worksheet_inputs:
+            current_file = worksheet_file
+            partial = next(results)
+            partial['override'] = is_override
+            yield partial
+
+    try:
+        aggregated_amounts, depot_grand_totals, provenance = merge_worksheet_partials(ordered_partials())
+    except FileNotFoundError:
+        print(f"ERROR: Worksheet file not found: {current_file}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"ERROR: Could not read worksheet file {current_file}: {e}")
+        sys.exit(1)
+    finally:
+        if executor:
+            executor.shutdown(cancel_futures=True)
+
+    if len(worksheet_files) > 1:
+        print_provenance_report(provenance, aggregated_amounts)
+    if args.provenance_csv:
+        try:
+            write_provenance_csv(provenance, aggregated_amounts, args.provenance_csv)
+            print(f"Provenance report written to {args.provenance_csv}")
+        except OSError as e:
+            print(f"Warning: Could not write provenance report to {args.provenance_csv}: {e}")
+
+    print(f"\nFinished reading worksheet. Aggregated {len(aggregated_amounts)} entries.")
+    # Optional: Print depot grand totals for debugging
+    # print("\n--- Depot Grand Totals ---")
+    # for depot, total in depot_grand_totals.items():
+    #     print(f"  Depot {depot}: {total}")
+    # print("--------------------------\n")
+
+    # 2. Read Recap Sheet (using fixed header row 6)
+    print(f"\nReading recap file: {args.recap_file}, sheet: {RECAP_SHEET_NAME}")
     try:
         # Load the existing workbook, ensure formulas are read (data_only=False)
         wb = load_workbook(args.recap_file, data_only=False)
-        ws = wb[RECAP_SHEET_NAME]
+    except FileNotFoundError:
+        print(f"ERROR: Recap file not found: {args.recap_file}")
+        sys.exit(1)
+    except Exception as e:
+        print(f"ERROR: Could not open recap workbook for updating: {e}")
+        sys.exit(1)
+    if RECAP_SHEET_NAME not in wb.sheetnames:
+        print(f"ERROR: Sheet '{RECAP_SHEET_NAME}' not found in {args.recap_file}. Sheets found: {wb.sheetnames}")
+        sys.exit(1)
+    ws = wb[RECAP_SHEET_NAME]
+
+    # The rows come from the loaded workbook; pandas is only needed where it
+    # would read cached formula results differently
+    recap_rows = get_recap_rows_from_sheet(ws)
+    if recap_rows is not None:
+        structure_texts, formula_rows = recap_rows
+        recap_headers = [cell.value for cell in ws[6]]
+    else:
+        print("  The recap has formulas in column A, row 6 or below its last values; reading their results with pandas.")
+        try:
+            df_recap = read_recap_frame(args.recap_file)
+        except Exception as e:
+            print(f"ERROR: Could not read recap file: {e}")
+            sys.exit(1)
+        structure_texts = get_recap_structure_texts(df_recap)
+        formula_rows = get_recap_formula_rows(ws, len(structure_texts))
+        recap_headers = list(df_recap.columns)
 
-        print("  Checking cells and updating non-formula cells only...")
+    # Check if the needed column was found using the names from Row 6
+    if RECAP_AMOUNT_COL not in recap_headers:
+        print(f"ERROR: Target amount column '{RECAP_AMOUNT_COL}' (expected C6) not found in header row 6 of sheet '{RECAP_SHEET_NAME}'. Found headers: {recap_headers}")
+        sys.exit(1)
+
+    # 3. Classify Recap Sheet Rows (or reuse the cached layout for this template)
+    layout = None
+    fingerprint = layout_fingerprint(structure_texts, formula_rows, mapping)
+    if args.use_layout_cache:
+        layout = load_cached_layout(fingerprint, args.layout_cache_dir)
+    if layout is not None:
+        print(f"\nUsing cached recap layout ({fingerprint[:12]}).")
+    else:
+        print("\nClassifying recap sheet rows...")
+        layout = classify_recap_rows(structure_texts, formula_rows)
+        if args.use_layout_cache:
+            save_cached_layout(fingerprint, layout, args.layout_cache_dir)
+
+    # 4. Populate Amounts, Mill/Depot Totals and Depot Grand Totals
+    print("\nProcessing recap sheet and populating amounts...")
+    recap_amounts, rows_updated = fill_recap_amounts(layout, aggregated_amounts, depot_grand_totals)
+    print(f"\nFinished processing recap sheet. Updated {rows_updated} rows (including totals).")
+
+    # 5. Save Updated Recap File
+    print(f"Saving updated data back to {args.recap_file}, sheet: {RECAP_SHEET_NAME}...")
+    try:
+        print("  Updating non-formula cells only...")
         cells_updated_values = 0
         cells_skipped_formulas = 0
+        changes = [] # (excel_row, old_value, new_value) for the run journal
+        fingerprint_before = file_fingerprint(args.recap_file) if args.use_journal else None
 
         # Update only the values in the Tons column (Column C), skipping formulas
-        for index, row_data in df_recap_modified.iterrows():
-            # Add 7 because Excel is 1-indexed and we have a header row at row 6
-            target_row_excel = index + 7
-            target_col_excel = 3 # Column C
-
-            # Get the cell object
-            target_cell = ws.cell(row=target_row_excel, column=target_col_excel)
-
-            # Check if the cell contains a formula
-            if target_cell.data_type == 'f':
-                # print(f"    Skipping cell {target_cell.coordinate} - contains formula.") # Optional debug print
+        for index, row_layout in enumerate(layout):
+            if row_layout.get('formula'):
                 cells_skipped_formulas += 1
-            else:
-                # Cell doesn't contain a formula, update its value
-                calculated_value = row_data[RECAP_AMOUNT_COL]
-                # Only write if the value needs changing
-                if target_cell.value != calculated_value:
-                     # -- REMOVE DEBUG: Print Save Action --
-                     # print(f"DEBUG: Saving - Cell: {target_cell.coordinate}, OldValue: {target_cell.value}, NewValue: {calculated_value}")
-                     # -- END REMOVE --
-                     target_cell.value = calculated_value
-                     cells_updated_values += 1
-                 # else: # If value is already correct, don't count as update
+                continue
+
+            target_cell = ws.cell(row=index + 7, column=3) # Column C
+            calculated_value = recap_amounts[index]
+            # Only write if the value needs changing
+            if target_cell.value != calculated_value:
+                changes.append((target_cell.row, target_cell.value, calculated_value))
+                target_cell.value = calculated_value
+                cells_updated_values += 1
 
         print(f"  Finished checking: Updated {cells_updated_values} non-formula cells, skipped {cells_skipped_formulas} formula cells.")
 
-        # Save while preserving formatting
-        wb.save(args.recap_file)
-        print("File saved successfully.")
+        # Save while preserving formatting. With nothing changed the file is left as it
+        # is, so it still matches the latest journal entry and can be rolled back.
+        if changes:
+            save_workbook_atomically(wb, args.recap_file)
+            print("File saved successfully.")
+        else:
+            print("No cells changed; the recap file was left untouched.")
     except PermissionError:
         print(f"\nERROR: Permission denied. Could not save '{args.recap_file}'.")
         print("Please ensure the file is closed in Excel and you have write permissions.")
@@ -514,8 +753,55 @@ def main():
         traceback.print_exc() # Print full traceback for saving errors
         sys.exit(1)
 
+    # 6. Journal the Changed Cells (so this run can be rolled back)
+    if args.use_journal and changes:
+        try:
+            run_id = record_run(args.recap_file, RECAP_SHEET_NAME, changes, fingerprint_before,
+                                file_fingerprint(args.recap_file), args.journal_dir,
+                                details={'worksheet_files': [str(f) for f in args.worksheet_files],
+                                         'override_files': [str(f) for f in args.override]})
+            prune_journal(args.recap_file, args.journal_dir, args.journal_keep_runs, args.journal_max_age_days)
+            print(f"Recorded run {run_id} ({len(changes)} cells) in the recap journal. "
+                  f"Undo it with: rollback \"{args.recap_file}\"")
+        except OSError as e:
+            print(f"Warning: The recap was saved, but this run could not be journaled: {e}")
+
     print("\nScript finished.")
 
+def rollback_main(argv):
+    """Handles 'scrap_allocator.py rollback RECAP_FILE [RUN_ID]'."""
+    parser = argparse.ArgumentParser(prog='scrap_allocator.py rollback',
+                                     description='Restore a recap file to how it was before an earlier run.')
+    parser.add_argument('recap_file', help='Path to the Recap Allocation Excel file to restore.')
+    parser.add_argument('run_id', nargs='?', help='Run to undo, along with every later run (default: the latest run).')
+    parser.add_argument('--list', action='store_true', help='List the recorded runs instead of rolling back.')
+    parser.add_argument('--force', action='store_true', help='Roll back even if the file changed since the latest recorded run.')
+    parser.add_argument('--journal-dir', default=JOURNAL_DIR, help=f'Folder of run journals (default: {JOURNAL_DIR}).')
+    args = parser.parse_args(argv)
+
+    if args.list:
+        runs = list_runs(args.recap_file, args.journal_dir)
+        if not runs:
+            print(f"No journal entries found for {args.recap_file}.")
+        for entry in runs:
+            print(f"  {entry['run_id']}  {entry['created']}  {entry['kind']:<10}  {len(entry['changes'])} cells")
+        return
+
+    try:
+        rollback_id, undone_ids, cells_restored = rollback_recap(args.recap_file, args.run_id, args.journal_dir, args.force)
+    except FileNotFoundError:
+        print(f"ERROR: Recap file not found: {args.recap_file}")
+        sys.exit(1)
+    except PermissionError:
+        print(f"ERROR: Permission denied. Could not save '{args.recap_file}'.")
+        print("Please ensure the file is closed in Excel and you have write permissions.")
+        sys.exit(1)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        sys.exit(1)
+    print(f"Rolled back {len(undone_ids)} run(s) ({', '.join(undone_ids)}), restoring {cells_restored} cells.")
+    print(f"The rollback was recorded as run {rollback_id}; roll that back to redo.")
+
 # --- Run Script --- (Ensure this is the VERY end of the file)
 if __name__ == "__main__":
     try:
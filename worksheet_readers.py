@@ -0,0 +1,152 @@
+import importlib.util
+from abc import ABC, abstractmethod
+from pathlib import Path
+
+import pandas as pd
+
+# --- Reader Configuration ---
+# Read-only engines to try for each worksheet file type, fastest first.
+# Openpyxl is kept as the fallback for .xlsx/.xlsm; it is also what the recap
+# write-back uses, because it is the only one that preserves formulas.
+READER_ENGINE_PREFERENCE = {
+    '.xlsx': ['calamine', 'openpyxl'],
+    '.xlsm': ['calamine', 'openpyxl'],
+    '.xlsb': ['calamine', 'pyxlsb'],
+    '.csv': ['csv'],
+}
+
+# Python module each engine needs to be importable
+ENGINE_MODULES = {
+    'calamine': 'python_calamine',
+    'openpyxl': 'openpyxl',
+    'pyxlsb': 'pyxlsb',
+    'csv': None,  # Handled by pandas itself
+}
+
+READER_ENGINE_CHOICES = ['auto'] + list(ENGINE_MODULES)
+
+
+def is_engine_available(engine):
+    """Returns True if the module backing a reader engine is installed."""
+    if engine not in ENGINE_MODULES:
+        return False
+    module_name = ENGINE_MODULES[engine]
+    return module_name is None or importlib.util.find_spec(module_name) is not None
+
+
+def get_worksheet_file_type(path):
+    """Returns the file type key ('.xlsx', '.csv', ...) used to pick a reader for a path."""
+    path = Path(path)
+    if path.is_dir():
+        # A folder of per-depot CSV exports
+        return '.csv'
+    return path.suffix.lower()
+
+
+# --- Reader Classes ---
+class WorksheetReader(ABC):
+    """Read-only access to the depot sheets of a worksheet input."""
+    engine = None
+
+    def __init__(self, path):
+        self.path = Path(path)
+
+    @abstractmethod
+    def sheet_names(self):
+        """Returns the names of the sheets (or CSV exports) in the input."""
+
+    @abstractmethod
+    def read_sheet(self, sheet_name, header):
+        """Reads one depot sheet into a DataFrame, using row `header` (0-based) as column names."""
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.close()
+
+
+class ExcelWorksheetReader(WorksheetReader):
+    """Reads workbook sheets through pandas with the given Excel engine.
+
+    The file is opened once and every sheet is parsed from that handle,
+    instead of re-opening the workbook for each depot sheet.
+    """
+
+    def __init__(self, path, engine):
+        super().__init__(path)
+        self.engine = engine
+        self._xls = pd.ExcelFile(self.path, engine=engine)
+
+    def sheet_names(self):
+        return list(self._xls.sheet_names)
+
+    def read_sheet(self, sheet_name, header):
+        return self._xls.parse(sheet_name=sheet_name, header=header)
+
+    def close(self):
+        self._xls.close()
+
+
+class CsvWorksheetReader(WorksheetReader):
+    """Reads per-depot CSV exports.
+
+    The path can be a single CSV file or a folder of them. Each file stands in
+    for the depot sheet with the same name as the file (e.g. '401Dallas.csv'),
+    and keeps the sheet's row layout so the same header row applies.
+    """
+    engine = 'csv'
+
+    def __init__(self, path):
+        super().__init__(path)
+        if self.path.is_dir():
+            csv_files = sorted(p for p in self.path.iterdir() if p.suffix.lower() == '.csv')
+        else:
+            csv_files = [self.path]
+        self._files = {p.stem: p for p in csv_files}
+
+    def sheet_names(self):
+        return list(self._files)
+
+    def read_sheet(self, sheet_name, header):
+        if sheet_name not in self._files:
+            raise ValueError(f"No CSV export found for sheet '{sheet_name}' in {self.path}")
+        # Keep blank lines so the header index lines up with the Excel row number
+        return pd.read_csv(self._files[sheet_name], header=header, skip_blank_lines=False,
+                           thousands=',', encoding='utf-8-sig')
+
+
+def open_worksheet_reader(path, engine='auto'):
+    """Opens a worksheet input with the requested engine, or the fastest installed one for 'auto'.
+
+    Raises FileNotFoundError if the path does not exist, and ValueError if the
+    file type is not supported or the requested engine cannot read it.
+    """
+    path = Path(path)
+    if not path.exists():
+        raise FileNotFoundError(f"Worksheet input not found: {path}")
+
+    file_type = get_worksheet_file_type(path)
+    supported_engines = READER_ENGINE_PREFERENCE.get(file_type)
+    if not supported_engines:
+        raise ValueError(f"Unsupported worksheet file type '{file_type}' for {path}. "
+                         f"Supported types: {', '.join(READER_ENGINE_PREFERENCE)}")
+
+    if engine == 'auto':
+        installed_engines = [e for e in supported_engines if is_engine_available(e)]
+        if not installed_engines:
+            raise ValueError(f"No reader engine installed for '{file_type}' files. "
+                             f"Install one of: {', '.join(ENGINE_MODULES[e] for e in supported_engines)}")
+        engine = installed_engines[0]
+    elif engine not in supported_engines:
+        raise ValueError(f"Reader engine '{engine}' cannot read '{file_type}' files. "
+                         f"Use one of: {', '.join(supported_engines)}")
+    elif not is_engine_available(engine):
+        raise ValueError(f"Reader engine '{engine}' requires the '{ENGINE_MODULES[engine]}' package.")
+
+    if engine == 'csv':
+        return CsvWorksheetReader(path)
+    return ExcelWorksheetReader(path, engine)